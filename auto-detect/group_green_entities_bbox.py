@@ -4,9 +4,10 @@ import hashlib
 import json
 import math
 import os
-from collections import defaultdict
+from collections import defaultdict, deque
 
 import ezdxf
+import numpy as np
 from ezdxf.math import Matrix44, bulge_to_arc
 
 
@@ -72,12 +73,22 @@ def is_continuous_linetype(doc: ezdxf.EzDxf, entity) -> bool:
     return lt.strip().upper() == "CONTINUOUS"
 
 
-def qkey(x: float, y: float, tol: float) -> tuple[int, int]:
+def qcell(x: float, y: float, tol: float) -> tuple[int, int]:
     if tol <= 0:
         raise ValueError("tol must be > 0")
     return (int(round(x / tol)), int(round(y / tol)))
 
 
+def pack_cell(ix: int, iy: int) -> int:
+    # 两个32位网格坐标拼成一个int作为dict键，哈希比2元组便宜
+    return ((ix & 0xFFFFFFFF) << 32) | (iy & 0xFFFFFFFF)
+
+
+def qkey(x: float, y: float, tol: float) -> int:
+    # 与 qcell + pack_cell 共用同一套键格式，point_buckets 与邻域网格遍历才能互相查到
+    return pack_cell(*qcell(x, y, tol))
+
+
 def line_endpoints(e):
     s = e.dxf.start
     t = e.dxf.end
@@ -96,54 +107,55 @@ def arc_endpoints(e):
 
 
 def lwpolyline_vertices(e):
-    pts = []
     try:
-        for p in e.get_points():
-            pts.append((float(p[0]), float(p[1])))
+        # LWPOLYLINE顶点存于numpy数组，需转回Python float
+        return [(float(x), float(y)) for x, y in e.get_points("xy")]
     except Exception:
-        for x, y, *_ in e:
-            pts.append((float(x), float(y)))
-    return pts
+        return [(float(x), float(y)) for x, y, *_ in e]
 
 
 def polyline_vertices(e):
-    pts = []
     try:
-        for v in e.vertices():
-            p = v.dxf.location
-            pts.append((float(p[0]), float(p[1])))
+        return [(p[0], p[1]) for p in (v.dxf.location for v in e.vertices())]
     except Exception:
-        pass
-    return pts
+        return []
+
+
+def _lwpolyline_connection_points(entity):
+    pts = lwpolyline_vertices(entity)
+    if not pts:
+        return []
+    if bool(getattr(entity, "closed", False)) or bool(getattr(entity.dxf, "closed", False)):
+        return pts
+    return [pts[0], pts[-1]]
+
+
+def _polyline_connection_points(entity):
+    pts = polyline_vertices(entity)
+    if not pts:
+        return []
+    try:
+        is_closed = bool(entity.is_closed)
+    except Exception:
+        is_closed = False
+    if is_closed:
+        return pts
+    return [pts[0], pts[-1]]
+
+
+_CONNECTION_POINTS_DISPATCH = {
+    "LINE": line_endpoints,
+    "ARC": arc_endpoints,
+    "LWPOLYLINE": _lwpolyline_connection_points,
+    "POLYLINE": _polyline_connection_points,
+}
 
 
 def entity_connection_points(entity):
-    t = entity.dxftype()
-    if t == "LINE":
-        return line_endpoints(entity)
-    if t == "ARC":
-        return arc_endpoints(entity)
-    if t == "LWPOLYLINE":
-        pts = lwpolyline_vertices(entity)
-        if not pts:
-            return []
-        if bool(getattr(entity, "closed", False)) or bool(getattr(entity.dxf, "closed", False)):
-            return pts
-        return [pts[0], pts[-1]]
-    if t == "POLYLINE":
-        pts = polyline_vertices(entity)
-        if not pts:
-            return []
-        try:
-            is_closed = bool(entity.is_closed)
-        except Exception:
-            is_closed = False
-        if is_closed:
-            return pts
-        return [pts[0], pts[-1]]
-    if t == "CIRCLE":
+    fn = _CONNECTION_POINTS_DISPATCH.get(entity.dxftype())
+    if fn is None:
         return []
-    return []
+    return fn(entity)
 
 
 def arc_bbox(entity):
@@ -181,71 +193,104 @@ def circle_bbox(entity):
     return cx - r, cy - r, cx + r, cy + r
 
 
-def entity_bbox(doc: ezdxf.EzDxf, entity, insert_depth: int = 4, _visited: set[str] | None = None):
-    t = entity.dxftype()
-    if not is_continuous_linetype(doc, entity):
+def _insert_bbox(doc: ezdxf.EzDxf, entity, insert_depth: int, _visited: set[str] | None):
+    if insert_depth <= 0:
         return None
-    if t == "INSERT":
-        if insert_depth <= 0:
-            return None
+    try:
+        name = str(entity.dxf.name)
+    except Exception:
+        return None
+    if _visited is None:
+        _visited = set()
+    if name in _visited:
+        return None
+    _visited.add(name)
+    try:
         try:
-            name = str(entity.dxf.name)
+            block = doc.blocks.get(name)
         except Exception:
             return None
-        if _visited is None:
-            _visited = set()
-        if name in _visited:
+        try:
+            m = entity.matrix44()
+        except Exception:
             return None
-        _visited.add(name)
+
+        bb_total = None
+        for child in block:
+            bb_child = entity_bbox(doc, child, insert_depth=insert_depth - 1, _visited=_visited)
+            if bb_child is None:
+                continue
+            bb_child_t = bbox_transform(m, bb_child)
+            bb_total = bb_child_t if bb_total is None else bbox_union(bb_total, bb_child_t)
+        return bb_total
+    finally:
         try:
-            try:
-                block = doc.blocks.get(name)
-            except Exception:
-                return None
-            try:
-                m = entity.matrix44()
-            except Exception:
-                return None
+            _visited.remove(name)
+        except Exception:
+            pass
 
-            bb_total = None
-            for child in block:
-                bb_child = entity_bbox(doc, child, insert_depth=insert_depth - 1, _visited=_visited)
-                if bb_child is None:
-                    continue
-                bb_child_t = bbox_transform(m, bb_child)
-                bb_total = bb_child_t if bb_total is None else bbox_union(bb_total, bb_child_t)
-            return bb_total
-        finally:
-            try:
-                _visited.remove(name)
-            except Exception:
-                pass
-    if t == "LINE":
-        (x0, y0), (x1, y1) = line_endpoints(entity)
-        return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
-    if t == "ARC":
-        return arc_bbox(entity)
-    if t == "CIRCLE":
-        return circle_bbox(entity)
-    if t == "POINT":
-        p = entity.dxf.location
-        x, y = float(p[0]), float(p[1])
-        return x, y, x, y
-    if t == "LWPOLYLINE":
-        pts = lwpolyline_vertices(entity)
-        if not pts:
-            return None
-        xs = [p[0] for p in pts]
-        ys = [p[1] for p in pts]
-        return min(xs), min(ys), max(xs), max(ys)
-    if t == "POLYLINE":
-        pts = polyline_vertices(entity)
-        if not pts:
-            return None
-        xs = [p[0] for p in pts]
-        ys = [p[1] for p in pts]
-        return min(xs), min(ys), max(xs), max(ys)
-    return None
+
+def _line_bbox(doc: ezdxf.EzDxf, entity, insert_depth: int, _visited: set[str] | None):
+    (x0, y0), (x1, y1) = line_endpoints(entity)
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+
+def _arc_bbox(doc: ezdxf.EzDxf, entity, insert_depth: int, _visited: set[str] | None):
+    return arc_bbox(entity)
+
+
+def _circle_bbox(doc: ezdxf.EzDxf, entity, insert_depth: int, _visited: set[str] | None):
+    return circle_bbox(entity)
+
+
+def _point_bbox(doc: ezdxf.EzDxf, entity, insert_depth: int, _visited: set[str] | None):
+    p = entity.dxf.location
+    x, y = float(p[0]), float(p[1])
+    return x, y, x, y
+
+
+# 顶点数达到该值时用numpy一次性求min/max，少量顶点时Python内建更快
+_NP_BBOX_MIN_POINTS = 64
+
+
+def _points_bbox(pts):
+    if not pts:
+        return None
+    if len(pts) >= _NP_BBOX_MIN_POINTS:
+        arr = np.asarray(pts, dtype=np.float64)
+        lo = arr.min(axis=0)
+        hi = arr.max(axis=0)
+        return float(lo[0]), float(lo[1]), float(hi[0]), float(hi[1])
+    xs, ys = zip(*pts)
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _lwpolyline_bbox(doc: ezdxf.EzDxf, entity, insert_depth: int, _visited: set[str] | None):
+    return _points_bbox(lwpolyline_vertices(entity))
+
+
+def _polyline_bbox(doc: ezdxf.EzDxf, entity, insert_depth: int, _visited: set[str] | None):
+    return _points_bbox(polyline_vertices(entity))
+
+
+_BBOX_DISPATCH = {
+    "LINE": _line_bbox,
+    "ARC": _arc_bbox,
+    "CIRCLE": _circle_bbox,
+    "POINT": _point_bbox,
+    "LWPOLYLINE": _lwpolyline_bbox,
+    "POLYLINE": _polyline_bbox,
+    "INSERT": _insert_bbox,
+}
+
+
+def entity_bbox(doc: ezdxf.EzDxf, entity, insert_depth: int = 4, _visited: set[str] | None = None):
+    fn = _BBOX_DISPATCH.get(entity.dxftype())
+    if fn is None:
+        return None
+    if not is_continuous_linetype(doc, entity):
+        return None
+    return fn(doc, entity, insert_depth, _visited)
 
 
 def entity_bbox_loose(doc: ezdxf.EzDxf, entity):
@@ -254,7 +299,10 @@ def entity_bbox_loose(doc: ezdxf.EzDxf, entity):
     bb = entity_bbox(doc, entity)
     if bb is not None:
         return bb
+    return _entity_anchor_bbox(entity)
+
 
+def _entity_anchor_bbox(entity):
     for attr in ("insert", "location", "center", "start", "end"):
         try:
             p = getattr(entity.dxf, attr)
@@ -1688,17 +1736,21 @@ def detect_frame_and_titleblock(doc: ezdxf.EzDxf, tol: float, frame_tol: float,
     items = []
 
     all_bbs = []
+    # (entity, 严格bbox)，供末尾外框兜底检查复用，避免再次遍历msp
+    strict_items = []
     for e in msp:
         if not is_continuous_linetype(doc, e):
             continue
-        bb = entity_bbox_loose(doc, e)
+        bb2 = entity_bbox(doc, e)
+        bb = bb2 if bb2 is not None else _entity_anchor_bbox(e)
         if bb is None:
             continue
         all_bbs.append(bb)
+        if bb2 is None:
+            continue
+        strict_items.append((e, bb2))
         if e.dxftype() in line_types:
-            bb2 = entity_bbox(doc, e)
-            if bb2 is not None:
-                items.append((e, bb2))
+            items.append((e, bb2))
 
     if not all_bbs:
         return set(), None
@@ -1715,24 +1767,21 @@ def detect_frame_and_titleblock(doc: ezdxf.EzDxf, tol: float, frame_tol: float,
     edge_eps = max(float(frame_tol) * 2.0, float(tol) * 5.0)
     seed_ratio = 0.8
 
-    seeds = []
-    for i, (_, bb) in enumerate(items):
-        bw = float(bb[2]) - float(bb[0])
-        bh = float(bb[3]) - float(bb[1])
-        touches_h = abs(float(bb[1]) - float(miny)) < edge_eps or abs(float(bb[3]) - float(maxy)) < edge_eps
-        touches_v = abs(float(bb[0]) - float(minx)) < edge_eps or abs(float(bb[2]) - float(maxx)) < edge_eps
-        if (touches_h and bw > w * seed_ratio) or (touches_v and bh > h * seed_ratio):
-            seeds.append(i)
-            continue
-        if (
-            abs(float(bb[0]) - float(minx)) < edge_eps
-            and abs(float(bb[1]) - float(miny)) < edge_eps
-            and abs(float(bb[2]) - float(maxx)) < edge_eps
-            and abs(float(bb[3]) - float(maxy)) < edge_eps
-        ):
-            seeds.append(i)
-
-    buckets: dict[tuple[int, int], list[int]] = defaultdict(list)
+    B = np.asarray([bb for _, bb in items], dtype=np.float64).reshape(-1, 4)
+    bw = B[:, 2] - B[:, 0]
+    bh = B[:, 3] - B[:, 1]
+    x0_lft = np.abs(B[:, 0] - minx) < edge_eps
+    y0_bot = np.abs(B[:, 1] - miny) < edge_eps
+    x1_rgt = np.abs(B[:, 2] - maxx) < edge_eps
+    y1_top = np.abs(B[:, 3] - maxy) < edge_eps
+    wide = bw > w * seed_ratio
+    tall = bh > h * seed_ratio
+    full_cover = x0_lft & y0_bot & x1_rgt & y1_top
+
+    seed_mask = ((y0_bot | y1_top) & wide) | ((x0_lft | x1_rgt) & tall) | full_cover
+    seeds = np.flatnonzero(seed_mask).tolist()
+
+    buckets: dict[int, list[int]] = defaultdict(list)
     for i, (e, _) in enumerate(items):
         for x, y in entity_connection_points(e):
             try:
@@ -1761,30 +1810,14 @@ def detect_frame_and_titleblock(doc: ezdxf.EzDxf, tol: float, frame_tol: float,
                     frame_set.add(j)
                     q.append(j)
 
-    outer_border = set()
-    for i in frame_set:
-        bb = items[i][1]
-        bw = float(bb[2]) - float(bb[0])
-        bh = float(bb[3]) - float(bb[1])
-        if bw > w * seed_ratio and abs(float(bb[1]) - float(miny)) < edge_eps and abs(float(bb[3]) - float(miny)) < edge_eps:
-            outer_border.add(i)
-            continue
-        if bw > w * seed_ratio and abs(float(bb[1]) - float(maxy)) < edge_eps and abs(float(bb[3]) - float(maxy)) < edge_eps:
-            outer_border.add(i)
-            continue
-        if bh > h * seed_ratio and abs(float(bb[0]) - float(minx)) < edge_eps and abs(float(bb[2]) - float(minx)) < edge_eps:
-            outer_border.add(i)
-            continue
-        if bh > h * seed_ratio and abs(float(bb[0]) - float(maxx)) < edge_eps and abs(float(bb[2]) - float(maxx)) < edge_eps:
-            outer_border.add(i)
-            continue
-        if (
-            abs(float(bb[0]) - float(minx)) < edge_eps
-            and abs(float(bb[1]) - float(miny)) < edge_eps
-            and abs(float(bb[2]) - float(maxx)) < edge_eps
-            and abs(float(bb[3]) - float(maxy)) < edge_eps
-        ):
-            outer_border.add(i)
+    outer_mask = (
+        (wide & y0_bot & (np.abs(B[:, 3] - miny) < edge_eps))
+        | (wide & (np.abs(B[:, 1] - maxy) < edge_eps) & y1_top)
+        | (tall & x0_lft & (np.abs(B[:, 2] - minx) < edge_eps))
+        | (tall & (np.abs(B[:, 0] - maxx) < edge_eps) & x1_rgt)
+        | full_cover
+    )
+    outer_border = {i for i in frame_set if outer_mask[i]}
 
     inner = set(frame_set) - set(outer_border) if frame_set else set(range(len(items)))
 
@@ -1855,12 +1888,7 @@ def detect_frame_and_titleblock(doc: ezdxf.EzDxf, tol: float, frame_tol: float,
         except Exception:
             pass
 
-    for e in msp:
-        if not is_continuous_linetype(doc, e):
-            continue
-        bb = entity_bbox(doc, e)
-        if bb is None:
-            continue
+    for e, bb in strict_items:
         if (
             abs(float(bb[0]) - float(minx)) < edge_eps
             and abs(float(bb[1]) - float(miny)) < edge_eps
@@ -1933,14 +1961,14 @@ def bbox_transform(m, bb):
     return min(xs), min(ys), max(xs), max(ys)
 
 
-def compute_bbox_for_indices(doc: ezdxf.EzDxf, entities, idxs, pad: float):
+def compute_bbox_for_indices(entity_bboxes, idxs, pad: float):
     minx = float("inf")
     miny = float("inf")
     maxx = float("-inf")
     maxy = float("-inf")
 
     for i in idxs:
-        bb = entity_bbox(doc, entities[i])
+        bb = entity_bboxes[i]
         if bb is None:
             continue
         x0, y0, x1, y1 = bb
@@ -1982,10 +2010,17 @@ def _bbox_close(a, b, eps: float = 1e-6) -> bool:
     )
 
 
+def _bboxes_signature(bboxes, eps: float = 1e-6) -> frozenset:
+    return frozenset((_qf(b[0], eps), _qf(b[1], eps), _qf(b[2], eps), _qf(b[3], eps)) for b in bboxes)
+
+
 def refine_and_merge_bboxes(initial_bboxes, all_entity_bboxes, pad: float, merge_gap: float):
     cur_bboxes = sorted(list(initial_bboxes), key=lambda b: (b[0], b[1], b[2], b[3]))
 
-    max_iters = 50
+    # 通常2轮内收敛；不收敛时多为在少数几个状态间振荡，用签名检测循环提前退出
+    max_iters = 8
+    recent_sigs: deque = deque(maxlen=4)
+    recent_sigs.append(_bboxes_signature(cur_bboxes))
     it = 0
     while True:
         it += 1
@@ -2009,6 +2044,11 @@ def refine_and_merge_bboxes(initial_bboxes, all_entity_bboxes, pad: float, merge
         ):
             return stabilized_bboxes
 
+        sig = _bboxes_signature(stabilized_bboxes)
+        if sig in recent_sigs:
+            return stabilized_bboxes
+        recent_sigs.append(sig)
+
         cur_bboxes = stabilized_bboxes
 
 
@@ -2064,11 +2104,26 @@ def group_green_entities(
     exclude_handles: set[str] | None = None,
     exclude_bbox=None,
 ):
+    """
+    单次遍历msp，按颜色分桶后分别做连通分组。
+    返回: {aci: (entities, entity_bboxes, groups)}，仅包含实际出现的颜色；
+    entity_bboxes 与 entities 平行（可能含None），供后续直接求组bbox。
+    """
     msp = doc.modelspace()
 
     supported = {"LINE", "ARC", "CIRCLE", "LWPOLYLINE", "POLYLINE", "INSERT"}
 
-    entities = []
+    md = None
+    if max_entity_diag is not None:
+        try:
+            md = float(max_entity_diag)
+        except Exception:
+            md = None
+        if md is not None and md <= 0.0:
+            md = None
+
+    per_color_entities: dict[int, list] = defaultdict(list)
+    per_color_bboxes: dict[int, list] = defaultdict(list)
     for e in msp:
         t = e.dxftype()
         if t not in supported:
@@ -2079,33 +2134,34 @@ def group_green_entities(
                     continue
             except Exception:
                 pass
-        if effective_aci_color(doc, e) not in target_acis:
+        aci = effective_aci_color(doc, e)
+        if aci not in target_acis:
             continue
         if not is_continuous_linetype(doc, e):
             continue
-        bb = None
-        if max_entity_diag is not None:
-            try:
-                md = float(max_entity_diag)
-            except Exception:
-                md = None
-            if md is not None and md > 0.0:
-                bb = entity_bbox(doc, e)
-                if bb is None:
-                    continue
-                if bbox_diag(bb) > md:
-                    continue
-        if exclude_bbox is not None:
+        bb = entity_bbox(doc, e)
+        if md is not None:
             if bb is None:
-                bb = entity_bbox(doc, e)
+                continue
+            if bbox_diag(bb) > md:
+                continue
+        if exclude_bbox is not None:
             if bb is not None and bbox_contains(exclude_bbox, bb):
                 continue
-        entities.append(e)
+        per_color_entities[aci].append(e)
+        per_color_bboxes[aci].append(bb)
+
+    return {
+        aci: (entities, per_color_bboxes[aci], _group_connected_entities(entities, tol))
+        for aci, entities in per_color_entities.items()
+    }
 
+
+def _group_connected_entities(entities, tol: float):
     uf = UnionFind(len(entities))
 
-    point_buckets: dict[tuple[int, int], list[tuple[float, float, int]]] = defaultdict(list)
-    first_owner: dict[tuple[int, int], int] = {}
+    point_buckets: dict[int, list[tuple[float, float, int]]] = defaultdict(list)
+    first_owner: dict[int, int] = {}
 
     circle_indices = []
 
@@ -2129,12 +2185,12 @@ def group_green_entities(
         minx, miny = cx - r - tol, cy - r - tol
         maxx, maxy = cx + r + tol, cy + r + tol
 
-        ix0, iy0 = qkey(minx, miny, tol)
-        ix1, iy1 = qkey(maxx, maxy, tol)
+        ix0, iy0 = qcell(minx, miny, tol)
+        ix1, iy1 = qcell(maxx, maxy, tol)
 
         for ix in range(min(ix0, ix1), max(ix0, ix1) + 1):
             for iy in range(min(iy0, iy1), max(iy0, iy1) + 1):
-                k = (ix, iy)
+                k = pack_cell(ix, iy)
                 if k not in point_buckets:
                     continue
                 for px, py, other_idx in point_buckets[k]:
@@ -2146,7 +2202,7 @@ def group_green_entities(
     for i in range(len(entities)):
         groups[uf.find(i)].append(i)
 
-    return entities, list(groups.values())
+    return list(groups.values())
 
 
 def read_dwgcodepage_from_text_dxf(path: str) -> str | None:
@@ -2719,22 +2775,22 @@ def main():
                     if title_bbox is None or not bbox_contains(title_bbox, obs_bb):
                         obstacle_entities.append((e, obs_bb))
 
-    colors = sorted(target_acis)
+    grouped_by_color = group_green_entities(
+        doc,
+        tol=tol,
+        target_acis=target_acis,
+        max_entity_diag=float(args.max_entity_diag),
+        exclude_handles=exclude_handles if exclude_handles else None,
+        exclude_bbox=title_bbox,
+    )
     per_color_bboxes = []
-    for c in colors:
-        entities, groups = group_green_entities(
-            doc,
-            tol=tol,
-            target_acis={c},
-            max_entity_diag=float(args.max_entity_diag),
-            exclude_handles=exclude_handles if exclude_handles else None,
-            exclude_bbox=title_bbox,
-        )
+    for c in sorted(grouped_by_color):
+        _, entity_bboxes, groups = grouped_by_color[c]
 
         group_bboxes = []
         group_entities = []
         for idxs in groups:
-            bb = compute_bbox_for_indices(doc, entities, idxs, pad=pad)
+            bb = compute_bbox_for_indices(entity_bboxes, idxs, pad=pad)
             if bb is None:
                 continue
             group_entities.append(idxs)
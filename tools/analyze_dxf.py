@@ -4,11 +4,10 @@
 """分析 DXF 文件中的图层、文字和实体。"""
 
 import sys
-import re
 from collections import Counter
 import ezdxf
 
-HAN_RE = re.compile(r"[\u4e00-\u9fff]")
+from symbol_lib import has_han
 
 def main():
     if len(sys.argv) < 2:
@@ -30,7 +29,7 @@ def main():
     print("=" * 60)
     han_blocks = []
     for blk in doc.blocks:
-        if HAN_RE.search(blk.name):
+        if has_han(blk.name):
             han_blocks.append(blk.name)
     print(f"  总数量：{len(han_blocks)}")
     for name in han_blocks[:50]:
@@ -41,23 +40,32 @@ def main():
     print("\n" + "=" * 60)
     print("文字实体分析（ModelSpace）：")
     print("=" * 60)
-    text_layers = Counter()
-    text_colors = Counter()
+    layers = []
+    colors = []
     han_texts = []
 
+    # 循环内只做取值，计数交给 Counter(iterable) 的 C 实现；
+    # TEXT/MTEXT 保持单循环，han_texts 才能按 ModelSpace 原顺序输出
+    add_layer = layers.append
+    add_color = colors.append
+    add_han = han_texts.append
     for e in msp.query("TEXT MTEXT"):
-        layer = e.dxf.layer
-        color = e.dxf.color if hasattr(e.dxf, 'color') else 256
-        text_layers[layer] += 1
-        text_colors[color] += 1
+        dxf = e.dxf
+        layer = dxf.layer
+        color = getattr(dxf, 'color', 256)
+        add_layer(layer)
+        add_color(color)
 
         if e.dxftype() == "TEXT":
-            text = e.dxf.text or ""
+            text = dxf.text or ""
         else:
             text = e.text or ""
 
-        if HAN_RE.search(text):
-            han_texts.append((text.strip()[:30], layer, color))
+        if has_han(text):
+            add_han((text.strip()[:30], layer, color))
+
+    text_layers = Counter(layers)
+    text_colors = Counter(colors)
 
     print("按图层统计：")
     for layer, cnt in text_layers.most_common(10):
@@ -76,9 +84,7 @@ def main():
     print("\n" + "=" * 60)
     print("实体类型统计（ModelSpace）：")
     print("=" * 60)
-    entity_types = Counter()
-    for e in msp:
-        entity_types[e.dxftype()] += 1
+    entity_types = Counter(e.dxftype() for e in msp)
     for et, cnt in entity_types.most_common():
         print(f"  - {et}: {cnt}")
 
@@ -4,26 +4,85 @@
 from __future__ import annotations
 
 import argparse
-import json
+import base64
 import shutil
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone
+from itertools import repeat
 from pathlib import Path
+from typing import Optional
 
 import ezdxf
 
 from symbol_lib import (
-	HAN_RE,
-	bbox_of_entities,
-	compute_descriptor,
-	encode_point_cloud,
-	flatten_entities,
+	DEFAULT_POINT_ENCODING,
+	bbox_of_geometry,
+	descriptor_from_geometry,
+	dumps_json,
+	encode_point_cloud_bytes,
+	flatten_geometry,
+	han_flags,
+	point_cloud_encoding,
+	point_cloud_from_geometry,
+	point_cloud_json,
 	save_index,
 )
 
 
-def has_han(text: str) -> bool:
-	return bool(HAN_RE.search(text))
+def _symbol_from_block(
+	blk,
+	doc: ezdxf.EzdxfDocument,
+	*,
+	with_point_cloud: bool,
+	sample_div: float,
+	max_points: int,
+	point_scale: int,
+	max_depth: int,
+	point_encoding: str = DEFAULT_POINT_ENCODING,
+	flatten_cache: Optional[dict] = None,
+) -> Optional[tuple[dict, Optional[bytes]]]:
+	"""单个 block -> (索引条目, 点云压缩字节)；无有效几何时返回 None。flatten_cache 在同一文档的各块间共享。"""
+	name = blk.name
+
+	raw_ents = list(blk)
+	geoms = flatten_geometry(raw_ents, doc, max_depth=max_depth, cache=flatten_cache)
+	mb = bbox_of_geometry(geoms)
+	if mb is None:
+		return None
+
+	desc = descriptor_from_geometry(geoms, mb)
+	norm = max(mb[2] - mb[0], mb[3] - mb[1]) or 1.0
+
+	item: dict = {
+		"name": name,
+		"block_name": name,
+		"bbox": [mb[0], mb[1], mb[2], mb[3]],
+		"norm": float(norm),
+		"descriptor": desc.to_dict(),
+	}
+
+	blob: Optional[bytes] = None
+	if with_point_cloud:
+		pts = point_cloud_from_geometry(geoms, mb, sample_div=sample_div, max_points=max_points)
+		n, blob = encode_point_cloud_bytes(pts, scale=point_scale, encoding=point_encoding)
+		item["point_cloud"] = point_cloud_json(n, blob, scale=point_scale, encoding=point_encoding)
+		if not n:
+			blob = None
+
+	return item, blob
+
+
+def _build_shard(dxf_path: str, names: list[str], opts: dict) -> list[tuple[dict, Optional[bytes]]]:
+	# ezdxf 文档不可 pickle：子进程各自重新读取 DXF，只处理分到的 block
+	doc = ezdxf.readfile(dxf_path)
+	cache: dict = {}
+	out = []
+	for name in names:
+		res = _symbol_from_block(doc.blocks[name], doc, flatten_cache=cache, **opts)
+		if res is not None:
+			out.append(res)
+	return out
 
 
 def build_index(
@@ -35,39 +94,48 @@ def build_index(
 	max_points: int,
 	point_scale: int,
 	max_depth: int,
+	blobs: Optional[dict[str, bytes]] = None,
+	jobs: int = 1,
+	dxf_path: Optional[str] = None,
+	point_encoding: str = DEFAULT_POINT_ENCODING,
 ) -> dict:
+	"""
+	blobs 非空时按块名收集点云压缩字节，供 write_sqlite 直接写入 BLOB。
+	jobs > 1 且给出 dxf_path 时，按 block 顺序切成连续分片交给进程池，结果顺序与串行一致。
+	"""
 	symbols: list[dict] = []
-	for blk in doc.blocks:
-		name = blk.name
-		if name.startswith("*"):
-			continue
-		if only_han_blocks and not has_han(name):
-			continue
-
-		raw_ents = list(blk)
-		flat = flatten_entities(raw_ents, doc, max_depth=max_depth)
-		mb = bbox_of_entities(flat)
-		if mb is None:
-			continue
-
-		desc = compute_descriptor(flat, mb)
-		norm = max(mb[2] - mb[0], mb[3] - mb[1]) or 1.0
-
-		item: dict = {
-			"name": name,
-			"block_name": name,
-			"bbox": [mb[0], mb[1], mb[2], mb[3]],
-			"norm": float(norm),
-			"descriptor": desc.to_dict(),
-		}
-
-		if with_point_cloud:
-			from symbol_lib import point_cloud_from_entities
+	# 直接按块记录名过滤匿名块（*U/*D/*Model_Space 等），跳过 BlockLayout.name 的属性转发
+	blocks = [br.block_layout for br in doc.block_records if not br.dxf.name.startswith("*")]
+	if only_han_blocks:
+		# 一次拼接扫描代替逐个块名调用正则
+		flags = han_flags([blk.name for blk in blocks])
+		blocks = [blk for blk, ok in zip(blocks, flags) if ok]
 
-			pts = point_cloud_from_entities(flat, mb, sample_div=sample_div, max_points=max_points)
-			item["point_cloud"] = encode_point_cloud(pts, scale=point_scale)
+	opts = {
+		"with_point_cloud": with_point_cloud,
+		"sample_div": sample_div,
+		"max_points": max_points,
+		"point_scale": point_scale,
+		"max_depth": max_depth,
+		"point_encoding": point_encoding,
+	}
+	if jobs > 1 and dxf_path and len(blocks) > 1:
+		names = [blk.name for blk in blocks]
+		step = -(-len(names) // min(jobs, len(names)))
+		shards = [names[i : i + step] for i in range(0, len(names), step)]
+		with ProcessPoolExecutor(max_workers=len(shards)) as ex:
+			parts = list(ex.map(_build_shard, repeat(dxf_path), shards, repeat(opts)))
+		results = [res for part in parts for res in part]
+	else:
+		cache: dict = {}
+		results = [
+			res for res in (_symbol_from_block(blk, doc, flatten_cache=cache, **opts) for blk in blocks) if res is not None
+		]
 
+	for item, blob in results:
 		symbols.append(item)
+		if blobs is not None and blob:
+			blobs[item["name"]] = blob
 
 	return {
 		"schema": 3 if with_point_cloud else 2,
@@ -76,20 +144,30 @@ def build_index(
 	}
 
 
-def write_sqlite(db_path: Path, index: dict, blocks_dxf_path: Path) -> None:
+def _decode_blob(pc: dict) -> Optional[bytes]:
+	data_b64 = pc.get("data_b64")
+	if not data_b64:
+		return None
+	try:
+		return base64.b64decode(str(data_b64).encode("ascii"))
+	except Exception:
+		return None
+
+
+def write_sqlite(db_path: Path, index: dict, blocks_dxf_path: Path, blobs: Optional[dict[str, bytes]] = None) -> None:
 	db_path.parent.mkdir(parents=True, exist_ok=True)
 	conn = sqlite3.connect(str(db_path))
 	try:
+		# 一次性批量写入，无需逐条落盘
+		conn.execute("PRAGMA synchronous=OFF")
+		conn.execute("PRAGMA journal_mode=MEMORY")
+		conn.execute("PRAGMA temp_store=MEMORY")
 		cur = conn.cursor()
-		cur.execute(
+		cur.executescript(
 			"""
 DROP TABLE IF EXISTS symbols;
-"""
-		)
-		cur.execute(
-			"""
 CREATE TABLE symbols (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  id INTEGER PRIMARY KEY,
   name TEXT NOT NULL,
   block_name TEXT NOT NULL,
   bbox_minx REAL,
@@ -101,33 +179,24 @@ CREATE TABLE symbols (
   point_cloud_blob BLOB,
   point_cloud_n INTEGER,
   point_cloud_scale INTEGER,
+  point_cloud_encoding TEXT,
   blocks_dxf_path TEXT NOT NULL,
   base_point TEXT NOT NULL,
   created_at TEXT NOT NULL
 );
 """
 		)
-		for sym in index.get("symbols", []):
-			bbox = sym.get("bbox") or [None, None, None, None]
-			pc = sym.get("point_cloud") or {}
-			blob = None
-			if pc.get("data_b64"):
-				import base64
-
-				try:
-					blob = base64.b64decode(str(pc.get("data_b64")).encode("ascii"))
-				except Exception:
-					blob = None
-			cur.execute(
-				"""
-INSERT INTO symbols(
-  name, block_name, bbox_minx, bbox_miny, bbox_maxx, bbox_maxy,
-  norm, descriptor_json,
-  point_cloud_blob, point_cloud_n, point_cloud_scale,
-  blocks_dxf_path, base_point, created_at
-) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
-""",
-				(
+
+		blobs = blobs or {}
+		blocks_dxf = str(blocks_dxf_path)
+		base_point = index.get("base_point") or "center"
+		created_at = index.get("created_at")
+
+		def rows():
+			for sym in index.get("symbols", []):
+				bbox = sym.get("bbox") or [None, None, None, None]
+				pc = sym.get("point_cloud") or {}
+				yield (
 					sym.get("name"),
 					sym.get("block_name"),
 					bbox[0],
@@ -135,15 +204,28 @@ INSERT INTO symbols(
 					bbox[2],
 					bbox[3],
 					sym.get("norm"),
-					json.dumps(sym.get("descriptor"), ensure_ascii=False),
-					blob,
+					dumps_json(sym.get("descriptor")),
+					blobs.get(sym.get("name")) or _decode_blob(pc),
 					pc.get("n") if pc else None,
 					pc.get("scale") if pc else None,
-					str(blocks_dxf_path),
-					index.get("base_point") or "center",
-					index.get("created_at"),
-				),
-			)
+					pc.get("encoding") if pc else None,
+					blocks_dxf,
+					base_point,
+					created_at,
+				)
+
+		cur.execute("BEGIN")
+		cur.executemany(
+			"""
+INSERT INTO symbols(
+  name, block_name, bbox_minx, bbox_miny, bbox_maxx, bbox_maxy,
+  norm, descriptor_json,
+  point_cloud_blob, point_cloud_n, point_cloud_scale, point_cloud_encoding,
+  blocks_dxf_path, base_point, created_at
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+""",
+			rows(),
+		)
 		conn.commit()
 	finally:
 		conn.close()
@@ -165,9 +247,21 @@ def main() -> int:
 	parser.add_argument("--sample-div", type=float, default=30.0, help="点云采样密度：max_dim / sample_div 作为步长")
 	parser.add_argument("--max-points", type=int, default=600, help="点云最大点数（下采样）")
 	parser.add_argument("--point-scale", type=int, default=32767, help="点云量化缩放（int16）")
+	parser.add_argument(
+		"--point-codec",
+		choices=("zlib", "zstd"),
+		default="zlib",
+		help="点云压缩算法（zstd 编解码更快，需要安装 zstandard；读取端也需要）",
+	)
+	parser.add_argument("--point-delta", action="store_true", help="压缩前对点序列逐行差分（体积更小）")
 	parser.add_argument("--max-depth", type=int, default=2, help="展开 INSERT 的最大递归深度")
+	parser.add_argument("--jobs", type=int, default=1, help="并行进程数（>1 时各进程重新读取 DXF 并分片处理 block）")
 	parser.add_argument("--sqlite", default=None, help="可选：输出 sqlite 数据库路径（例如 out/lib.sqlite）")
 	args = parser.parse_args()
+	try:
+		point_encoding = point_cloud_encoding(args.point_codec, delta=bool(args.point_delta))
+	except RuntimeError as e:
+		parser.error(f"--point-codec {args.point_codec}: {e}")
 
 	blocks_dxf_path = Path(args.blocks_dxf).expanduser().resolve()
 	out_dir = Path(args.out_dir).expanduser().resolve()
@@ -175,6 +269,7 @@ def main() -> int:
 
 	doc = ezdxf.readfile(str(blocks_dxf_path))
 	only_han_blocks = bool(args.only_han_blocks) or not bool(args.include_non_han)
+	blobs: Optional[dict[str, bytes]] = {} if args.sqlite else None
 	index = build_index(
 		doc,
 		only_han_blocks=only_han_blocks,
@@ -183,10 +278,19 @@ def main() -> int:
 		max_points=int(args.max_points),
 		point_scale=int(args.point_scale),
 		max_depth=int(args.max_depth),
+		blobs=blobs,
+		jobs=int(args.jobs),
+		dxf_path=str(blocks_dxf_path),
+		point_encoding=point_encoding,
 	)
 	index["base_point"] = args.base_point
 	if args.with_point_cloud:
-		index["point_cloud"] = {"sample_div": float(args.sample_div), "max_points": int(args.max_points), "scale": int(args.point_scale)}
+		index["point_cloud"] = {
+			"sample_div": float(args.sample_div),
+			"max_points": int(args.max_points),
+			"scale": int(args.point_scale),
+			"encoding": point_encoding,
+		}
 
 	# 固定输出文件名
 	out_blocks = out_dir / "blocks.dxf"
@@ -196,7 +300,7 @@ def main() -> int:
 	save_index(out_index, index)
 
 	if args.sqlite:
-		write_sqlite(Path(args.sqlite).expanduser().resolve(), index, out_blocks)
+		write_sqlite(Path(args.sqlite).expanduser().resolve(), index, out_blocks, blobs=blobs)
 
 	print(f"符号库已生成：{out_dir}")
 	print(f"- blocks: {out_blocks}")
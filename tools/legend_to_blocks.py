@@ -18,35 +18,21 @@ from __future__ import annotations
 import argparse
 import math
 import re
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Iterable, Optional
 
 import ezdxf
+import numpy as np
 from ezdxf.addons.importer import Importer
 
-HAN_RE = re.compile(r"[\u4e00-\u9fff]")
+try:
+	from numba import njit  # type: ignore[import-not-found]
+except Exception:
+	njit = None
 
-
-def resolved_aci(entity, doc: ezdxf.EzdxfDocument, fallback: int = 7) -> int:
-	"""解析实体的最终 ACI 颜色（简化版：处理 BYLAYER/BYBLOCK）。"""
-	try:
-		true_color = getattr(entity.dxf, "true_color", None)
-	except Exception:
-		true_color = None
-
-	# 这里主要用 ACI 做筛选；如你后续需要 TrueColor，可扩展为 RGB 判断
-	color = getattr(entity.dxf, "color", 256)
-	if color in (None, 0, 256):
-		try:
-			layer = doc.layers.get(entity.dxf.layer)
-			layer_color = getattr(layer.dxf, "color", fallback)
-			if layer_color in (None, 0, 256):
-				return fallback
-			return int(layer_color)
-		except Exception:
-			return fallback
-	return int(color)
+from symbol_lib import has_han, make_aci_resolver
 
 
 def bbox2d(entity) -> Optional[tuple[float, float, float, float]]:
@@ -71,11 +57,12 @@ def bbox2d(entity) -> Optional[tuple[float, float, float, float]]:
 			p = entity.dxf.insert
 			return (p.x, p.y, p.x, p.y)
 		if t == "LWPOLYLINE":
-			pts = list(entity.get_points("xy"))
-			if not pts:
+			# 与 symbol_lib.bbox2d 相同：直接读顶点数组的前两列
+			v = entity.lwpoints.values  # type: ignore[attr-defined]
+			if not len(v):
 				return None
-			xs = [p[0] for p in pts]
-			ys = [p[1] for p in pts]
+			xs = v[:, 0].tolist()
+			ys = v[:, 1].tolist()
 			return (min(xs), min(ys), max(xs), max(ys))
 		if t == "POLYLINE":
 			pts = [v.dxf.location for v in entity.vertices]  # type: ignore[attr-defined]
@@ -89,12 +76,158 @@ def bbox2d(entity) -> Optional[tuple[float, float, float, float]]:
 	return None
 
 
+def bboxes_bulk(entities: list) -> np.ndarray:
+	"""
+	批量计算 2D 外包框，结果与逐个调用 bbox2d 一致。
+	先按类型抽取坐标到数组，再用 numpy 一次性求 min/max；
+	返回 (N,4) float64，无法计算的实体对应行为 NaN。
+	"""
+	n = len(entities)
+	out = np.full((n, 4), np.nan, dtype=np.float64)
+
+	line_idx: list[int] = []
+	line_pts: list[tuple[float, float, float, float]] = []
+	circle_idx: list[int] = []
+	circle_crs: list[tuple[float, float, float]] = []
+	point_idx: list[int] = []
+	point_xys: list[tuple[float, float]] = []
+	poly_idx: list[int] = []
+	poly_counts: list[int] = []
+	poly_xys: list[np.ndarray] = []
+
+	for i, entity in enumerate(entities):
+		t = entity.dxftype()
+		try:
+			if t == "LINE":
+				s = entity.dxf.start
+				e = entity.dxf.end
+				line_pts.append((s.x, s.y, e.x, e.y))
+				line_idx.append(i)
+			elif t == "CIRCLE":
+				c = entity.dxf.center
+				circle_crs.append((c.x, c.y, float(entity.dxf.radius)))
+				circle_idx.append(i)
+			elif t == "POINT":
+				p = entity.dxf.location
+				point_xys.append((p.x, p.y))
+				point_idx.append(i)
+			elif t in ("TEXT", "MTEXT", "INSERT"):
+				p = entity.dxf.insert
+				point_xys.append((p.x, p.y))
+				point_idx.append(i)
+			elif t == "LWPOLYLINE":
+				xy = entity.lwpoints.values[:, 0:2]
+				if len(xy):
+					poly_xys.append(xy)
+					poly_counts.append(len(xy))
+					poly_idx.append(i)
+			elif t == "POLYLINE":
+				pts = [(p.x, p.y) for p in (v.dxf.location for v in entity.vertices)]  # type: ignore[attr-defined]
+				if pts:
+					poly_xys.append(np.asarray(pts, dtype=np.float64))
+					poly_counts.append(len(pts))
+					poly_idx.append(i)
+		except Exception:
+			continue
+
+	if line_idx:
+		a = np.asarray(line_pts, dtype=np.float64)
+		starts = a[:, 0:2]
+		ends = a[:, 2:4]
+		out[line_idx] = np.concatenate([np.minimum(starts, ends), np.maximum(starts, ends)], axis=1)
+	if circle_idx:
+		a = np.asarray(circle_crs, dtype=np.float64)
+		centers = a[:, 0:2]
+		r = a[:, 2:3]
+		out[circle_idx] = np.concatenate([centers - r, centers + r], axis=1)
+	if point_idx:
+		a = np.asarray(point_xys, dtype=np.float64)
+		out[point_idx] = np.concatenate([a, a], axis=1)
+	if poly_idx:
+		a = np.concatenate(poly_xys).astype(np.float64, copy=False)
+		offsets = np.concatenate([[0], np.cumsum(poly_counts)[:-1]])
+		out[poly_idx] = np.concatenate([np.minimum.reduceat(a, offsets, axis=0), np.maximum.reduceat(a, offsets, axis=0)], axis=1)
+	return out
+
+
+def collect_soa(
+	msp,
+	doc: ezdxf.EzdxfDocument,
+	acis: Optional[Iterable[int]] = None,
+) -> tuple[list, np.ndarray, np.ndarray]:
+	"""
+	一次遍历 msp，物化为结构数组（SoA）：
+	返回 (entities, aci: int32[N], bbox: float64[N,4])，后续筛选全部用 numpy 掩码完成。
+	给定 acis 时先按颜色过滤（保持原顺序），只对留下的实体计算 bbox。
+	"""
+	entities = list(msp)
+	resolve = make_aci_resolver(doc)
+	aci = np.fromiter((resolve(e) for e in entities), dtype=np.int32, count=len(entities))
+	if acis is not None:
+		keep = np.flatnonzero(np.isin(aci, list(acis)))
+		entities = [entities[i] for i in keep]
+		aci = aci[keep]
+	return entities, aci, bboxes_bulk(entities)
+
+
 def overlap(a: tuple[float, float, float, float], b: tuple[float, float, float, float], tol: float) -> bool:
 	ax0, ay0, ax1, ay1 = a
 	bx0, by0, bx1, by1 = b
 	return not (ax1 + tol < bx0 or bx1 + tol < ax0 or ay1 + tol < by0 or by1 + tol < ay0)
 
 
+# 单个 bbox 每个方向最多登记到这么多个网格；更大的框（图例外框、长管线等）单独与全部框比较，
+# 否则其覆盖的网格数随面积 / cell^2 增长，一个大框就能拖慢甚至撑爆内存
+_GRID_MAX_SPAN = 8
+
+
+def overlap_candidate_pairs(boxes: list[tuple[float, float, float, float]], tol: float) -> Iterable[tuple[int, int]]:
+	"""用均匀网格枚举可能满足 overlap(tol) 的 bbox 对，每对只产出一次（i < j）。"""
+	if len(boxes) < 2:
+		return
+	sizes = sorted(max(b[2] - b[0], b[3] - b[1]) for b in boxes)
+	cell = max(sizes[len(sizes) // 2], tol * 4.0, 1e-6)
+	# 两框各外扩 tol/2 后相交 <=> overlap(a, b, tol)
+	half = tol * 0.5
+
+	ranges: list[tuple[int, int, int, int]] = []
+	large: list[int] = []
+	is_large = [False] * len(boxes)
+	grid: dict[tuple[int, int], list[int]] = defaultdict(list)
+	for i, (x0, y0, x1, y1) in enumerate(boxes):
+		ix0 = math.floor((x0 - half) / cell)
+		iy0 = math.floor((y0 - half) / cell)
+		ix1 = math.floor((x1 + half) / cell)
+		iy1 = math.floor((y1 + half) / cell)
+		ranges.append((ix0, iy0, ix1, iy1))
+		if ix1 - ix0 >= _GRID_MAX_SPAN or iy1 - iy0 >= _GRID_MAX_SPAN:
+			large.append(i)
+			is_large[i] = True
+			continue
+		for ix in range(ix0, ix1 + 1):
+			for iy in range(iy0, iy1 + 1):
+				grid[(ix, iy)].append(i)
+
+	for (gx, gy), members in grid.items():
+		for a in range(len(members)):
+			i = members[a]
+			ri = ranges[i]
+			for b in range(a + 1, len(members)):
+				j = members[b]
+				rj = ranges[j]
+				# 只在两者共同覆盖区域的左下角网格产出，避免重复
+				if max(ri[0], rj[0]) != gx or max(ri[1], rj[1]) != gy:
+					continue
+				yield i, j
+
+	# 大框不进网格：逐个与其余全部框配对（两个大框之间只由编号小的一方产出）
+	for i in large:
+		for j in range(len(boxes)):
+			if j == i or (is_large[j] and j < i):
+				continue
+			yield (i, j) if i < j else (j, i)
+
+
 class UnionFind:
 	def __init__(self, n: int) -> None:
 		self.parent = list(range(n))
@@ -120,6 +253,52 @@ class UnionFind:
 			self.rank[ra] += 1
 
 
+def _uf_find(parent, i):
+	while parent[i] != i:
+		parent[i] = parent[parent[i]]
+		i = parent[i]
+	return i
+
+
+def _sweep_union(boxes, tol):
+	"""
+	按 minx 排序后扫描：只与 x 区间可能相交的后继比较 y，满足 overlap(tol) 则合并。
+	返回 union-find 的 parent 数组（int64[N]）。
+	"""
+	n = boxes.shape[0]
+	parent = np.arange(n)
+	rank = np.zeros(n, dtype=np.int32)
+	order = np.argsort(boxes[:, 0], kind="mergesort")
+	for a in range(n):
+		i = order[a]
+		reach = boxes[i, 2] + tol
+		for b in range(a + 1, n):
+			j = order[b]
+			if boxes[j, 0] > reach:
+				break
+			if boxes[i, 3] + tol < boxes[j, 1] or boxes[j, 3] + tol < boxes[i, 1]:
+				continue
+			if boxes[i, 0] > boxes[j, 2] + tol:
+				continue
+			ri = _uf_find(parent, i)
+			rj = _uf_find(parent, j)
+			if ri == rj:
+				continue
+			if rank[ri] < rank[rj]:
+				parent[ri] = rj
+			elif rank[ri] > rank[rj]:
+				parent[rj] = ri
+			else:
+				parent[rj] = ri
+				rank[ri] += 1
+	return parent
+
+
+if njit is not None:
+	_uf_find = njit(cache=True)(_uf_find)
+	_sweep_union = njit(cache=True)(_sweep_union)
+
+
 @dataclass(frozen=True)
 class Label:
 	text: str
@@ -127,7 +306,7 @@ class Label:
 	y: float
 
 
-@dataclass
+@dataclass(slots=True)
 class Cluster:
 	id: int
 	entity_indices: list[int]
@@ -135,22 +314,17 @@ class Cluster:
 	miny: float
 	maxx: float
 	maxy: float
+	# 派生量在构造时算好，分配阶段会被反复读取
+	cx: float = field(init=False)
+	cy: float = field(init=False)
+	width: float = field(init=False)
+	height: float = field(init=False)
 
-	@property
-	def cx(self) -> float:
-		return (self.minx + self.maxx) * 0.5
-
-	@property
-	def cy(self) -> float:
-		return (self.miny + self.maxy) * 0.5
-
-	@property
-	def width(self) -> float:
-		return self.maxx - self.minx
-
-	@property
-	def height(self) -> float:
-		return self.maxy - self.miny
+	def __post_init__(self) -> None:
+		self.cx = (self.minx + self.maxx) * 0.5
+		self.cy = (self.miny + self.maxy) * 0.5
+		self.width = self.maxx - self.minx
+		self.height = self.maxy - self.miny
 
 
 def sanitize_block_name(name: str, max_len: int = 80) -> str:
@@ -167,73 +341,72 @@ def sanitize_block_name(name: str, max_len: int = 80) -> str:
 	return n
 
 
-def extract_labels(msp, doc: ezdxf.EzdxfDocument, label_layer: Optional[str], label_aci: int) -> list[Label]:
+def extract_labels(entities: list, aci: np.ndarray, label_layer: Optional[str], label_aci: int) -> list[Label]:
+	"""在 collect_soa 的结果上筛选图例文字，颜色直接复用预先解析好的 aci 数组。"""
 	labels: list[Label] = []
-	for e in msp.query("TEXT"):
-		if label_layer and e.dxf.layer != label_layer:
+	for i in np.flatnonzero(aci == label_aci):
+		e = entities[i]
+		if e.dxftype() != "TEXT":
 			continue
-		if resolved_aci(e, doc) != label_aci:
+		if label_layer and e.dxf.layer != label_layer:
 			continue
 		text = (e.dxf.text or "").strip()
-		if not text or not HAN_RE.search(text):
+		if not text or not has_han(text):
 			continue
 		labels.append(Label(text=text, x=float(e.dxf.insert.x), y=float(e.dxf.insert.y)))
 	return labels
 
 
 def build_green_clusters(
-	msp,
-	doc: ezdxf.EzdxfDocument,
+	soa: tuple[list, np.ndarray, np.ndarray],
 	labels: list[Label],
 	green_aci: int,
 	region_margin_x: float,
 	region_margin_y: float,
 	cluster_tol: float,
-) -> tuple[list, list[tuple[float, float, float, float]], list[Cluster]]:
+) -> tuple[list, np.ndarray, list[Cluster]]:
 	# 仅在“图例区域”附近聚类，速度快且不容易把管线等大结构纳入
-	lx = [l.x for l in labels]
-	ly = [l.y for l in labels]
-	minx, maxx = min(lx), max(lx)
-	miny, maxy = min(ly), max(ly)
+	pts = np.array([(l.x, l.y) for l in labels], dtype=np.float64)
+	minx, miny = pts.min(axis=0)
+	maxx, maxy = pts.max(axis=0)
 
 	rx0 = minx - region_margin_x
 	rx1 = maxx + region_margin_x
 	ry0 = miny - region_margin_y
 	ry1 = maxy + region_margin_y
 
-	entities = []
-	boxes: list[tuple[float, float, float, float]] = []
-	for e in msp:
-		if resolved_aci(e, doc) != green_aci:
-			continue
-		b = bbox2d(e)
-		if b is None:
-			continue
-		cx = (b[0] + b[2]) * 0.5
-		cy = (b[1] + b[3]) * 0.5
-		if not (rx0 <= cx <= rx1 and ry0 <= cy <= ry1):
-			continue
-		entities.append(e)
-		boxes.append(b)
-
-	uf = UnionFind(len(entities))
-	for i in range(len(entities)):
-		bi = boxes[i]
-		for j in range(i + 1, len(entities)):
-			if overlap(bi, boxes[j], tol=cluster_tol):
-				uf.union(i, j)
+	all_entities, aci, all_boxes = soa
+	cx = (all_boxes[:, 0] + all_boxes[:, 2]) * 0.5
+	cy = (all_boxes[:, 1] + all_boxes[:, 3]) * 0.5
+	# NaN 行（无 bbox）在比较中恒为 False，自然被过滤
+	mask = (aci == green_aci) & (rx0 <= cx) & (cx <= rx1) & (ry0 <= cy) & (cy <= ry1)
+	keep = np.flatnonzero(mask)
+	entities = [all_entities[i] for i in keep]
+	boxes = all_boxes[keep]
 
 	cluster_map: dict[int, list[int]] = defaultdict(list)
-	for i in range(len(entities)):
-		cluster_map[uf.find(i)].append(i)
+	if njit is not None:
+		# numba 可用：排序扫描 + union-find 全部在 nopython 内核中完成
+		parent = _sweep_union(np.ascontiguousarray(boxes), float(cluster_tol))
+		for i in range(len(entities)):
+			cluster_map[int(_uf_find(parent, i))].append(i)
+	else:
+		box_list = boxes.tolist()
+		uf = UnionFind(len(entities))
+		for i, j in overlap_candidate_pairs(box_list, cluster_tol):
+			if overlap(box_list[i], box_list[j], tol=cluster_tol):
+				uf.union(i, j)
+		for i in range(len(entities)):
+			cluster_map[uf.find(i)].append(i)
 
 	clusters: list[Cluster] = []
 	for cid, idxs in cluster_map.items():
-		minx2 = min(boxes[i][0] for i in idxs)
-		miny2 = min(boxes[i][1] for i in idxs)
-		maxx2 = max(boxes[i][2] for i in idxs)
-		maxy2 = max(boxes[i][3] for i in idxs)
-		clusters.append(Cluster(id=cid, entity_indices=idxs, minx=minx2, miny=miny2, maxx=maxx2, maxy=maxy2))
+		sub = boxes[idxs]
+		lo = sub[:, 0:2].min(axis=0)
+		hi = sub[:, 2:4].max(axis=0)
+		clusters.append(
+			Cluster(id=cid, entity_indices=idxs, minx=float(lo[0]), miny=float(lo[1]), maxx=float(hi[0]), maxy=float(hi[1]))
+		)
 
 	return entities, boxes, clusters
 
@@ -241,28 +414,43 @@ def build_green_clusters(
 def assign_labels_to_clusters(labels: list[Label], clusters: list[Cluster], y_expand: float = 30.0) -> dict[Label, Cluster]:
 	# 贪心分配：按 y 从上到下，每个 label 选一个“未使用”的最优 cluster
 	labels_sorted = sorted(labels, key=lambda l: l.y, reverse=True)
-	available = {c.id: c for c in clusters}
+	entries = [(c.minx, c.maxx, c.miny, c.maxy, c.cy) for c in clusters]
+	used: set[int] = set()
 	result: dict[Label, Cluster] = {}
 
+	# 按 cy 排序建索引：满足 y 带条件的簇必有 |cy - label.y| <= height/2 + y_expand，
+	# 用最大高度放宽窗口后二分定位候选，避免每个 label 扫全部簇
+	by_cy = sorted(range(len(clusters)), key=lambda k: entries[k][4])
+	cys = [entries[k][4] for k in by_cy]
+	window = y_expand + max((c.height for c in clusters), default=0.0)
+
 	for label in labels_sorted:
-		best: Optional[Cluster] = None
+		label_x = label.x
+		label_y = label.y
+		best = -1
 		best_score = float("inf")
-		for c in available.values():
-			if c.maxx <= label.x:
+		lo = bisect_left(cys, label_y - window)
+		hi = bisect_right(cys, label_y + window)
+		for k in by_cy[lo:hi]:
+			if k in used:
+				continue
+			minx, maxx, miny, maxy, cy = entries[k]
+			if maxx <= label_x:
 				continue
-			if not (c.miny - y_expand <= label.y <= c.maxy + y_expand):
+			if not (miny - y_expand <= label_y <= maxy + y_expand):
 				continue
-			dx = max(0.0, c.minx - label.x)
-			dy = abs(c.cy - label.y)
+			dx = max(0.0, minx - label_x)
+			dy = abs(cy - label_y)
 			score = dx + dy * 5.0  # y 更重要，避免同一行左右符号误匹配
-			if score < best_score:
+			# 同分时取原顺序靠前的簇，与逐个扫描的结果保持一致
+			if score < best_score or (score == best_score and k < best):
 				best_score = score
-				best = c
+				best = k
 
-		if best is None:
+		if best < 0:
 			continue
-		result[label] = best
-		available.pop(best.id, None)
+		result[label] = clusters[best]
+		used.add(best)
 
 	return result
 
@@ -293,13 +481,14 @@ def main() -> int:
 	if label_layer is None and "V-TXT1" in doc.layers:
 		label_layer = "V-TXT1"
 
-	labels = extract_labels(msp, doc, label_layer=label_layer, label_aci=args.label_aci)
+	# 只遍历一次 msp：文字筛选与绿色聚类共用同一份 entities/aci/bbox
+	soa = collect_soa(msp, doc, acis=(args.label_aci, args.green_aci))
+	labels = extract_labels(soa[0], soa[1], label_layer=label_layer, label_aci=args.label_aci)
 	if not labels:
 		raise SystemExit(f"未找到图例文字（layer={label_layer!r}, aci={args.label_aci}），请调整 --label-layer/--label-aci")
 
 	entities, _, clusters = build_green_clusters(
-		msp,
-		doc,
+		soa,
 		labels=labels,
 		green_aci=args.green_aci,
 		region_margin_x=args.region_margin_x,
@@ -334,6 +523,8 @@ def main() -> int:
 
 		blk = out_doc.blocks.new(name=name, base_point=(0, 0, 0))
 		src_entities = [entities[i] for i in cluster.entity_indices]
+		# Importer 每次调用只登记用到的图层/线型等名称，表项与嵌套块统一在 finalize() 中导入一次；
+		# 逐簇调用没有重复的依赖扫描，且比 e.copy() 多做了句柄/属主清理，保持不变
 		imp.import_entities(src_entities, blk)
 
 		# 把符号平移到 block 基点（建议用 bbox center，便于后续旋转/缩放）
@@ -344,13 +535,16 @@ def main() -> int:
 			base_x = cluster.minx
 			base_y = cluster.miny
 
+		# 逐实体 translate 比 transform(Matrix44) 更快（ezdxf 对平移有专门的快速路径）；
+		# 不能改用非零 block 基点，下游按“几何已平移到原点附近”处理
 		dx = -base_x
 		dy = -base_y
-		for e in blk:
-			try:
-				e.translate(dx, dy, 0)  # type: ignore[attr-defined]
-			except Exception:
-				pass
+		if dx or dy:
+			for e in blk:
+				try:
+					e.translate(dx, dy, 0)  # type: ignore[attr-defined]
+				except Exception:
+					pass
 
 		if args.preview_grid:
 			# 网格排版预览
@@ -4,30 +4,45 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
 import math
 import re
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, Optional
+from typing import Optional
 
 import ezdxf
+import numpy as np
 from ezdxf.addons.importer import Importer
 
+try:
+	from numba import njit  # type: ignore[import-not-found]
+except Exception:
+	njit = None
+
 from symbol_lib import (
 	SymbolDescriptor,
 	bbox2d,
-	bbox_of_entities,
-	chamfer_best_rotation,
-	compute_descriptor,
+	bbox_of_geometry,
+	chamfer_best_rotation_many,
+	chamfer_error_bound,
+	chamfer_lower_bound,
 	decode_point_cloud,
 	descriptor_distance,
-	flatten_entities,
+	descriptor_distance_batch,
+	descriptor_from_geometry,
+	flatten_geometry,
 	load_index,
+	make_aci_resolver,
+	match_batch,
 	merge_bbox,
-	point_cloud_from_entities,
-	resolved_aci,
+	point_cloud_from_geometry,
+	point_tree,
+	radial_profile,
+	stack_descriptors,
 )
 
 
@@ -37,17 +52,6 @@ def overlap(a: tuple[float, float, float, float], b: tuple[float, float, float,
 	return not (ax1 + tol < bx0 or bx1 + tol < ax0 or ay1 + tol < by0 or by1 + tol < ay0)
 
 
-def grid_cells_for_bbox(b: tuple[float, float, float, float], cell: float) -> Iterable[tuple[int, int]]:
-	x0, y0, x1, y1 = b
-	ix0 = int(x0 // cell)
-	iy0 = int(y0 // cell)
-	ix1 = int(x1 // cell)
-	iy1 = int(y1 // cell)
-	for ix in range(ix0, ix1 + 1):
-		for iy in range(iy0, iy1 + 1):
-			yield (ix, iy)
-
-
 @dataclass
 class Cluster:
 	indices: list[int]
@@ -79,6 +83,43 @@ class UnionFind:
 			self.rank[ra] += 1
 
 
+def bbox_grid(boxes: list[tuple[float, float, float, float]], cell: float) -> dict[int, dict[int, list[int]]]:
+	"""
+	网格索引：ix -> iy -> 覆盖该 cell 的 bbox 下标（升序）。按行分两级，查询时整行只取一次，不必构造 (ix, iy) 元组。
+	所有 (下标, ix, iy) 三元组用 numpy 一次展开并排序，Python 层只按 cell 切片建 dict。
+	"""
+	if not boxes:
+		return {}
+	arr = np.asarray(boxes, dtype=np.float64)
+	ix0 = np.floor_divide(arr[:, 0], cell).astype(np.int64)
+	iy0 = np.floor_divide(arr[:, 1], cell).astype(np.int64)
+	ix1 = np.floor_divide(arr[:, 2], cell).astype(np.int64)
+	iy1 = np.floor_divide(arr[:, 3], cell).astype(np.int64)
+	h = iy1 - iy0 + 1
+	counts = (ix1 - ix0 + 1) * h
+
+	eid = np.repeat(np.arange(len(boxes), dtype=np.int64), counts)
+	# 每个 bbox 内的展开序号 -> (ix, iy)，先 ix 后 iy
+	offs = np.arange(len(eid), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+	hh = np.repeat(h, counts)
+	cx = np.repeat(ix0, counts) + offs // hh
+	cy = np.repeat(iy0, counts) + offs % hh
+
+	order = np.lexsort((eid, cy, cx))
+	cx = cx[order]
+	cy = cy[order]
+	starts = np.flatnonzero(np.r_[True, (cx[1:] != cx[:-1]) | (cy[1:] != cy[:-1])])
+	ends = np.r_[starts[1:], len(order)]
+	ids = eid[order].tolist()
+	grid: dict[int, dict[int, list[int]]] = {}
+	for kx, ky, s0, s1 in zip(cx[starts].tolist(), cy[starts].tolist(), starts.tolist(), ends.tolist()):
+		row = grid.get(kx)
+		if row is None:
+			row = grid[kx] = {}
+		row[ky] = ids[s0:s1]
+	return grid
+
+
 def cluster_entities(
 	entities: list,
 	boxes: list[tuple[float, float, float, float]],
@@ -86,10 +127,7 @@ def cluster_entities(
 	cell_size: float,
 	tol: float,
 ) -> list[Cluster]:
-	grid: dict[tuple[int, int], list[int]] = defaultdict(list)
-	for i, b in enumerate(boxes):
-		for key in grid_cells_for_bbox(b, cell_size):
-			grid[key].append(i)
+	grid = bbox_grid(boxes, cell_size)
 
 	visited = [False] * len(entities)
 	clusters: list[Cluster] = []
@@ -107,11 +145,18 @@ def cluster_entities(
 			bb = boxes[cur]
 			bb_list.append(bb)
 
-			# 找潜在邻居：查 bbox 覆盖的网格
-			exp = (bb[0] - tol, bb[1] - tol, bb[2] + tol, bb[3] + tol)
+			# 找潜在邻居：查外扩 tol 后的 bbox 覆盖的网格
+			iy0 = int((bb[1] - tol) // cell_size)
+			iy1 = int((bb[3] + tol) // cell_size)
 			candidates: set[int] = set()
-			for cell_key in grid_cells_for_bbox(exp, cell_size):
-				candidates.update(grid.get(cell_key, []))
+			for ix in range(int((bb[0] - tol) // cell_size), int((bb[2] + tol) // cell_size) + 1):
+				row = grid.get(ix)
+				if row is None:
+					continue
+				for iy in range(iy0, iy1 + 1):
+					bucket = row.get(iy)
+					if bucket:
+						candidates.update(bucket)
 			for j in candidates:
 				if visited[j]:
 					continue
@@ -170,6 +215,220 @@ def entity_key_points(entity) -> list[tuple[float, float]]:
 	return []
 
 
+def _uf_find(parent, i):
+	while parent[i] != i:
+		parent[i] = parent[parent[i]]
+		i = parent[i]
+	return i
+
+
+def _morton2(ix, iy):
+	"""(ix, iy) 非负网格坐标（< 2^31）按位交织成 Morton 码；标量和 int64 数组都适用。"""
+	ix = (ix | (ix << 16)) & 0x0000FFFF0000FFFF
+	ix = (ix | (ix << 8)) & 0x00FF00FF00FF00FF
+	ix = (ix | (ix << 4)) & 0x0F0F0F0F0F0F0F0F
+	ix = (ix | (ix << 2)) & 0x3333333333333333
+	ix = (ix | (ix << 1)) & 0x5555555555555555
+	iy = (iy | (iy << 16)) & 0x0000FFFF0000FFFF
+	iy = (iy | (iy << 8)) & 0x00FF00FF00FF00FF
+	iy = (iy | (iy << 4)) & 0x0F0F0F0F0F0F0F0F
+	iy = (iy | (iy << 2)) & 0x3333333333333333
+	iy = (iy | (iy << 1)) & 0x5555555555555555
+	return ix | (iy << 1)
+
+
+def _connect_kernel(keys, eid, xs, ys, sx, sy, tol2, n):
+	"""
+	关键点已按网格 cell 的 Morton 码排序（空间上相邻的 cell 在内存里也相邻）；
+	对每个点二分定位 3x3 邻域 cell 的区间，距离 <= tol 且属于不同实体则合并。
+	返回 union-find 的 parent 数组（int64[n]）。
+	"""
+	parent = np.arange(n)
+	rank = np.zeros(n, dtype=np.int32)
+	for a in range(keys.shape[0]):
+		i = eid[a]
+		x = xs[a]
+		y = ys[a]
+		for dx in range(-1, 2):
+			for dy in range(-1, 2):
+				k = _morton2(sx[a] + dx, sy[a] + dy)
+				lo = np.searchsorted(keys, k)
+				hi = np.searchsorted(keys, k, side="right")
+				for b in range(lo, hi):
+					j = eid[b]
+					if i == j:
+						continue
+					if (x - xs[b]) * (x - xs[b]) + (y - ys[b]) * (y - ys[b]) > tol2:
+						continue
+					ri = _uf_find(parent, i)
+					rj = _uf_find(parent, j)
+					if ri == rj:
+						continue
+					if rank[ri] < rank[rj]:
+						parent[ri] = rj
+					elif rank[ri] > rank[rj]:
+						parent[rj] = ri
+					else:
+						parent[rj] = ri
+						rank[ri] += 1
+	return parent
+
+
+def _uf_roots(parent):
+	"""对每个元素做一次 find（带路径压缩），返回根数组。"""
+	roots = np.empty(parent.shape[0], dtype=np.int64)
+	for i in range(parent.shape[0]):
+		roots[i] = _uf_find(parent, i)
+	return roots
+
+
+if njit is not None:
+	_uf_find = njit(cache=True)(_uf_find)
+	_morton2 = njit(cache=True)(_morton2)
+	_connect_kernel = njit(cache=True)(_connect_kernel)
+	_uf_roots = njit(cache=True)(_uf_roots)
+
+
+def _connect_groups_numba(entities: list, *, tol: float, cell: float) -> np.ndarray:
+	# 关键点展开为扁平数组，整段网格查询 + union-find 交给 numba 内核；返回每个实体的分组标签
+	xy, eid = extract_keypoints_bulk(entities)
+
+	n = len(entities)
+	if not len(eid):
+		return np.arange(n, dtype=np.int64)
+
+	xs = np.ascontiguousarray(xy[:, 0])
+	ys = np.ascontiguousarray(xy[:, 1])
+	ix = np.floor(xs / cell).astype(np.int64)
+	iy = np.floor(ys / cell).astype(np.int64)
+	# 平移到从 1 开始，保证邻域 cell 坐标非负；按 Morton 码排序让邻域查询的内存访问更集中
+	sx = ix - ix.min() + 1
+	sy = iy - iy.min() + 1
+	keys = _morton2(sx, sy)
+	order = np.argsort(keys, kind="stable")
+	parent = _connect_kernel(
+		keys[order],
+		eid[order],
+		xs[order],
+		ys[order],
+		sx[order],
+		sy[order],
+		tol * tol,
+		n,
+	)
+	return _uf_roots(parent)
+
+
+def extract_keypoints_bulk(entities: list) -> tuple[np.ndarray, np.ndarray]:
+	"""
+	entity_key_points 的批量版：先按 dxftype 分桶抽取原始参数，再按类型用 numpy 一次算出关键点。
+	返回 (xy: float64[N,2], eid: int64[N])；点的先后顺序与逐个调用不同，但点集一致。
+	"""
+	line_ids: list[int] = []
+	line_rows: list[tuple[float, float, float, float]] = []
+	arc_ids: list[int] = []
+	arc_rows: list[tuple[float, float, float, float, float]] = []
+	circle_ids: list[int] = []
+	circle_rows: list[tuple[float, float, float]] = []
+	point_ids: list[int] = []
+	point_rows: list[tuple[float, float]] = []
+	poly_ids: list[int] = []
+	poly_xys: list[np.ndarray] = []
+
+	for i, entity in enumerate(entities):
+		t = entity.dxftype()
+		try:
+			if t == "LINE":
+				s = entity.dxf.start
+				en = entity.dxf.end
+				line_rows.append((s.x, s.y, en.x, en.y))
+				line_ids.append(i)
+			elif t == "ARC":
+				c = entity.dxf.center
+				arc_rows.append((c.x, c.y, float(entity.dxf.radius), float(entity.dxf.start_angle), float(entity.dxf.end_angle)))
+				arc_ids.append(i)
+			elif t == "CIRCLE":
+				c = entity.dxf.center
+				circle_rows.append((c.x, c.y, float(entity.dxf.radius)))
+				circle_ids.append(i)
+			elif t == "POINT":
+				p = entity.dxf.location
+				point_rows.append((p.x, p.y))
+				point_ids.append(i)
+			elif t == "INSERT":
+				p = entity.dxf.insert
+				point_rows.append((p.x, p.y))
+				point_ids.append(i)
+			elif t == "LWPOLYLINE":
+				xy = entity.lwpoints.values[:, 0:2]
+				if len(xy):
+					poly_xys.append(xy)
+					poly_ids.append(i)
+			elif t == "POLYLINE":
+				pts = [(p.x, p.y) for p in (v.dxf.location for v in entity.vertices)]  # type: ignore[attr-defined]
+				if pts:
+					poly_xys.append(np.asarray(pts, dtype=np.float64))
+					poly_ids.append(i)
+		except Exception:
+			continue
+
+	xy_parts: list[np.ndarray] = []
+	eid_parts: list[np.ndarray] = []
+	if line_ids:
+		a = np.asarray(line_rows, dtype=np.float64)
+		xy_parts.append(a.reshape(-1, 2))
+		eid_parts.append(np.repeat(np.asarray(line_ids, dtype=np.int64), 2))
+	if arc_ids:
+		a = np.asarray(arc_rows, dtype=np.float64)
+		c, r = a[:, 0:2], a[:, 2:3]
+		ang = np.radians(a[:, 3:5])
+		ends = np.stack([c[:, 0:1] + r * np.cos(ang), c[:, 1:2] + r * np.sin(ang)], axis=2)
+		xy_parts.append(ends.reshape(-1, 2))
+		eid_parts.append(np.repeat(np.asarray(arc_ids, dtype=np.int64), 2))
+	if circle_ids:
+		a = np.asarray(circle_rows, dtype=np.float64)
+		c, r = a[:, 0:2], a[:, 2]
+		zero = np.zeros_like(r)
+		offs = np.stack([np.stack([r, zero], 1), np.stack([-r, zero], 1), np.stack([zero, r], 1), np.stack([zero, -r], 1)], axis=1)
+		xy_parts.append((c[:, None, :] + offs).reshape(-1, 2))
+		eid_parts.append(np.repeat(np.asarray(circle_ids, dtype=np.int64), 4))
+	if point_ids:
+		xy_parts.append(np.asarray(point_rows, dtype=np.float64))
+		eid_parts.append(np.asarray(point_ids, dtype=np.int64))
+	if poly_ids:
+		xy_parts.append(np.concatenate(poly_xys).astype(np.float64, copy=False))
+		eid_parts.append(np.repeat(np.asarray(poly_ids, dtype=np.int64), [len(p) for p in poly_xys]))
+
+	if not xy_parts:
+		return np.zeros((0, 2), dtype=np.float64), np.zeros(0, dtype=np.int64)
+	return np.concatenate(xy_parts), np.concatenate(eid_parts)
+
+
+def _connect_groups_kdtree(entities: list, *, tol: float) -> Optional[np.ndarray]:
+	"""cKDTree.query_pairs 找出 tol 内的关键点对，连通分量交给 scipy.sparse.csgraph，返回分组标签；无 scipy 时返回 None。"""
+	try:
+		from scipy.sparse import coo_matrix  # type: ignore[import-not-found]
+		from scipy.sparse.csgraph import connected_components  # type: ignore[import-not-found]
+		from scipy.spatial import cKDTree  # type: ignore[import-not-found]
+	except Exception:
+		return None
+
+	n = len(entities)
+	xy, eid = extract_keypoints_bulk(entities)
+	if len(eid):
+		pairs = cKDTree(xy).query_pairs(r=tol, output_type="ndarray")
+		a = eid[pairs[:, 0]]
+		b = eid[pairs[:, 1]]
+		keep = a != b
+		a = a[keep]
+		b = b[keep]
+	else:
+		a = b = np.zeros(0, dtype=np.int64)
+	graph = coo_matrix((np.ones(len(a), dtype=np.int8), (a, b)), shape=(n, n))
+	_, labels = connected_components(graph, directed=False)
+	return labels
+
+
 def cluster_entities_connectivity(
 	entities: list,
 	boxes: list[tuple[float, float, float, float]],
@@ -192,38 +451,63 @@ def cluster_entities_connectivity(
 	if not math.isfinite(cell) or cell <= 1e-9:
 		cell = tol * 4.0
 
-	def key(x: float, y: float) -> tuple[int, int]:
-		return (int(math.floor(x / cell)), int(math.floor(y / cell)))
-
-	grid: dict[tuple[int, int], list[tuple[int, float, float]]] = defaultdict(list)
-	uf = UnionFind(len(entities))
-
-	tol2 = tol * tol
-	for i, e in enumerate(entities):
-		pts = entity_key_points(e)
-		for x, y in pts:
-			k = key(x, y)
-			# 查邻域 3x3 cells 的点
-			for dx in (-1, 0, 1):
-				for dy in (-1, 0, 1):
-					for j, ox, oy in grid.get((k[0] + dx, k[1] + dy), []):
-						if i == j:
-							continue
-						if (x - ox) * (x - ox) + (y - oy) * (y - oy) <= tol2:
-							uf.union(i, j)
-			grid[k].append((i, x, y))
-
-	groups: dict[int, list[int]] = defaultdict(list)
-	for i in range(len(entities)):
-		groups[uf.find(i)].append(i)
-
-	clusters: list[Cluster] = []
-	for _, idxs in groups.items():
-		merged = merge_bbox(boxes[i] for i in idxs)
-		if merged is None:
-			continue
-		clusters.append(Cluster(indices=idxs, bbox=merged))
-	return clusters
+	labels: Optional[np.ndarray] = None
+	if njit is not None:
+		labels = _connect_groups_numba(entities, tol=tol, cell=cell)
+	elif cell >= tol:
+		# 网格不小于 tol 时 3x3 邻域覆盖全部 tol 内点对，可等价换成 KD 树范围查询
+		labels = _connect_groups_kdtree(entities, tol=tol)
+	if labels is None:
+
+		def key(x: float, y: float) -> tuple[int, int]:
+			return (int(math.floor(x / cell)), int(math.floor(y / cell)))
+
+		grid: dict[tuple[int, int], list[tuple[int, float, float]]] = defaultdict(list)
+		uf = UnionFind(len(entities))
+
+		tol2 = tol * tol
+		for i, e in enumerate(entities):
+			pts = entity_key_points(e)
+			for x, y in pts:
+				k = key(x, y)
+				# 查邻域 3x3 cells 的点
+				for dx in (-1, 0, 1):
+					for dy in (-1, 0, 1):
+						for j, ox, oy in grid.get((k[0] + dx, k[1] + dy), []):
+							if i == j:
+								continue
+							if (x - ox) * (x - ox) + (y - oy) * (y - oy) <= tol2:
+								uf.union(i, j)
+				grid[k].append((i, x, y))
+
+		labels = np.fromiter((uf.find(i) for i in range(len(entities))), dtype=np.int64, count=len(entities))
+
+	return clusters_from_labels(labels, boxes)
+
+
+def clusters_from_labels(labels: np.ndarray, boxes: list[tuple[float, float, float, float]]) -> list[Cluster]:
+	"""
+	按分组标签切出簇：稳定 argsort 后每组是一段连续下标（组内升序），bbox 用 reduceat 按段求 min/max。
+	簇按组内最小下标排序，与逐个追加到 dict 的分组顺序一致。
+	"""
+	if not len(labels):
+		return []
+	order = np.argsort(labels, kind="stable")
+	srt = labels[order]
+	starts = np.flatnonzero(np.r_[True, srt[1:] != srt[:-1]])
+	# 组按首个（最小）成员下标排序
+	grp = np.argsort(order[starts], kind="stable")
+	ends = np.r_[starts[1:], len(order)]
+	bx = np.asarray(boxes, dtype=np.float64)[order]
+	lo = np.minimum.reduceat(bx[:, 0:2], starts).tolist()
+	hi = np.maximum.reduceat(bx[:, 2:4], starts).tolist()
+	order_l = order.tolist()
+	starts_l = starts.tolist()
+	ends_l = ends.tolist()
+	return [
+		Cluster(indices=order_l[starts_l[g] : ends_l[g]], bbox=(lo[g][0], lo[g][1], hi[g][0], hi[g][1]))
+		for g in grp.tolist()
+	]
 
 
 def best_match(desc: SymbolDescriptor, library: list[tuple[str, SymbolDescriptor]]) -> tuple[Optional[str], float]:
@@ -237,6 +521,166 @@ def best_match(desc: SymbolDescriptor, library: list[tuple[str, SymbolDescriptor
 	return best_name, best_score
 
 
+def best_fine_match(
+	probes: list[tuple[float, str]],
+	template_points: dict[str, dict],
+	cand_pts,
+	*,
+	use_canonical: bool = False,
+) -> tuple[Optional[str], float, float, float]:
+	"""
+	精匹配：在粗匹配 TopK（按 coarse 升序）中选 Chamfer 最小者，返回 (name, coarse, chamfer, angle)。
+	先算旋转不变下界最小的模板，其余模板只有下界不超过当前最优（加上 chamfer_error_bound 的误差余量）时才需要计算；
+	并列时取 coarse 顺序靠前者，结果与逐个计算全部模板一致（无 scipy 时按量化后的 Chamfer 比较，同样一致）。
+	"""
+	best_k = -1
+	best_chamfer = float("inf")
+	best_angle = 0.0
+
+	def consider(ks: list[int]) -> None:
+		nonlocal best_k, best_chamfer, best_angle
+		tpls = [template_points[probes[k][1]] for k in ks]
+		fine = chamfer_best_rotation_many(
+			[t["points"] for t in tpls],
+			cand_pts,
+			template_trees=[t.get("tree") for t in tpls],
+			cand_tree=cand_tree,
+			use_canonical=use_canonical,
+		)
+		for k, (ch_score, angle) in zip(ks, fine):
+			if ch_score < best_chamfer or (best_k >= 0 and ch_score == best_chamfer and k < best_k):
+				best_k = k
+				best_chamfer = ch_score
+				best_angle = angle
+
+	# 候选点云的树每簇只建一次，两轮 consider 共用
+	cand_tree = point_tree(cand_pts) if probes else None
+	if probes:
+		cand_radii = radial_profile(cand_pts)
+		lbs = [chamfer_lower_bound(template_points[name]["radii"], cand_radii) for _, name in probes]
+		order = sorted(range(len(probes)), key=lambda k: lbs[k])
+		consider(order[:1])
+		# 下界是精确值，已算出的 Chamfer 可能带量化误差：余量覆盖它和浮点舍入，避免误剪
+		limit = best_chamfer * (1.0 + 1e-9) + 1e-12 + chamfer_error_bound()
+		rest = [k for k in order[1:] if lbs[k] <= limit]
+		if rest:
+			consider(rest)
+
+	if best_k < 0:
+		return None, float("inf"), best_chamfer, best_angle
+	return probes[best_k][1], probes[best_k][0], best_chamfer, best_angle
+
+
+def coarse_candidates(geoms: list, ctx: dict) -> Optional[tuple[tuple[float, float, float, float], list[tuple[float, str]], object]]:
+	"""
+	单个簇的粗匹配，返回 (bbox, probes, cand_pts)：probes 为按 coarse 升序的 (coarse, name) TopK，
+	cand_pts 为精匹配用的候选点云；超尺寸或无候选时返回 None。
+	"""
+	bb = bbox_of_geometry(geoms)
+	if bb is None:
+		return None
+	if max(bb[2] - bb[0], bb[3] - bb[1]) > ctx["max_size"]:
+		return None
+
+	desc = descriptor_from_geometry(geoms, bb)
+
+	# 粗匹配：descriptor_distance TopK（并列时保持库顺序）
+	coarse = descriptor_distance_batch(desc, ctx["library_stack"], metric=ctx["coarse_metric"])
+	hits = np.flatnonzero(coarse <= ctx["score_threshold"])
+	if not len(hits):
+		return None
+	topk = max(1, ctx["coarse_topk"])
+	if len(hits) > topk:
+		# 先用 np.partition 求第 K 小的分数 O(L) 截断，只对剩下的少数候选做稳定排序
+		kth = np.partition(coarse[hits], topk - 1)[topk - 1]
+		hits = hits[coarse[hits] <= kth]
+	hits = hits[np.argsort(coarse[hits], kind="stable")][:topk]
+	names = ctx["library_names"]
+	template_points = ctx["template_points"]
+
+	cand_pts = point_cloud_from_geometry(geoms, bb, sample_div=ctx["sample_div"], max_points=ctx["max_points"])
+	probes = [(float(coarse[k]), names[k]) for k in hits.tolist() if names[k] in template_points]
+	return bb, probes, cand_pts
+
+
+def match_cluster(geoms: list, ctx: dict) -> Optional[tuple[tuple[float, float, float, float], str, float, float, float]]:
+	"""
+	单个簇的粗匹配 + 精匹配，只用 entity_geometry 结果和 ctx 中的库数据（可在子进程中运行）。
+	返回 (bbox, name, coarse, chamfer, angle)；超尺寸、无候选或 Chamfer 超阈值时返回 None。
+	"""
+	staged = coarse_candidates(geoms, ctx)
+	if staged is None:
+		return None
+	bb, probes, cand_pts = staged
+
+	# 精匹配：Chamfer Distance + 旋转
+	best_name, best_coarse, best_chamfer, best_angle = best_fine_match(
+		probes, ctx["template_points"], cand_pts, use_canonical=ctx["use_canonical"]
+	)
+	if best_name is None or best_chamfer > ctx["chamfer_threshold"]:
+		return None
+	return bb, best_name, best_coarse, best_chamfer, best_angle
+
+
+def match_clusters_by_template(
+	geoms_list: list[list], ctx: dict, *, n_jobs: int = -1
+) -> list[Optional[tuple[tuple[float, float, float, float], str, float, float, float]]]:
+	"""
+	与逐簇 match_cluster 结果一致的批量版本：先对全部簇做粗匹配，再按模板分组，
+	同一模板对所有命中它的簇用 match_batch 线程并行算 Chamfer（模板树共用）。
+	每簇取 Chamfer 最小者，并列时取 coarse 顺序靠前者；不做下界剪枝，适合簇多、CPU 多的场景。
+	"""
+	template_points = ctx["template_points"]
+	staged = [coarse_candidates(g, ctx) for g in geoms_list]
+
+	refs_by_name: dict[str, list[tuple[int, int]]] = defaultdict(list)
+	for i, st in enumerate(staged):
+		if st is None:
+			continue
+		for k, (_, name) in enumerate(st[1]):
+			refs_by_name[name].append((i, k))
+
+	best: dict[int, tuple[int, float, float]] = {}
+	for name, refs in refs_by_name.items():
+		tpl = template_points[name]
+		fine = match_batch(
+			tpl["points"],
+			[staged[i][2] for i, _ in refs],
+			template_tree=tpl.get("tree"),
+			use_canonical=ctx["use_canonical"],
+			n_jobs=n_jobs,
+		)
+		for (i, k), (ch_score, angle) in zip(refs, fine):
+			cur = best.get(i)
+			if cur is None or ch_score < cur[1] or (ch_score == cur[1] and k < cur[0]):
+				best[i] = (k, ch_score, angle)
+
+	results: list = []
+	for i, st in enumerate(staged):
+		if st is None or i not in best:
+			results.append(None)
+			continue
+		bb, probes, _ = st
+		k, ch_score, angle = best[i]
+		if ch_score > ctx["chamfer_threshold"]:
+			results.append(None)
+			continue
+		results.append((bb, probes[k][1], probes[k][0], ch_score, angle))
+	return results
+
+
+_MATCH_CTX: dict = {}
+
+
+def _init_match_worker(ctx: dict) -> None:
+	# 库数据随 initializer 每个子进程只传一次
+	_MATCH_CTX.update(ctx)
+
+
+def _match_worker(geoms: list):
+	return match_cluster(geoms, _MATCH_CTX)
+
+
 def linear_length(entity) -> float:
 	"""用于“管线过滤”的粗略长度估计（只覆盖常见线性实体）。"""
 	t = entity.dxftype()
@@ -245,34 +689,54 @@ def linear_length(entity) -> float:
 			s = entity.dxf.start
 			en = entity.dxf.end
 			return float(math.hypot(float(en.x - s.x), float(en.y - s.y)))
-		if t == "LWPOLYLINE":
-			pts = list(entity.get_points("xy"))
-			if len(pts) < 2:
-				return 0.0
-			total = 0.0
-			for (x0, y0), (x1, y1) in zip(pts, pts[1:]):
-				total += float(math.hypot(float(x1 - x0), float(y1 - y0)))
-			if bool(getattr(entity, "closed", False)):
-				x0, y0 = pts[-1]
-				x1, y1 = pts[0]
-				total += float(math.hypot(float(x1 - x0), float(y1 - y0)))
-			return total
-		if t == "POLYLINE":
-			vs = [v.dxf.location for v in entity.vertices]  # type: ignore[attr-defined]
-			if len(vs) < 2:
+		if t in ("LWPOLYLINE", "POLYLINE"):
+			# 多段线整体交给 numpy：np.diff + np.hypot，Python 层开销与顶点数无关
+			if t == "LWPOLYLINE":
+				p = entity.lwpoints.values[:, 0:2]  # type: ignore[attr-defined]
+				is_closed = bool(getattr(entity, "closed", False))
+			else:
+				p = np.array([(v.dxf.location.x, v.dxf.location.y) for v in entity.vertices], dtype=np.float64)  # type: ignore[attr-defined]
+				is_closed = bool(getattr(entity, "is_closed", False))
+			if len(p) < 2:
 				return 0.0
-			pts = [(float(p.x), float(p.y)) for p in vs]
-			total = 0.0
-			for (x0, y0), (x1, y1) in zip(pts, pts[1:]):
-				total += float(math.hypot(x1 - x0, y1 - y0))
-			if bool(getattr(entity, "is_closed", False)):
-				total += float(math.hypot(pts[0][0] - pts[-1][0], pts[0][1] - pts[-1][1]))
-			return total
+			d = np.diff(p, axis=0, append=p[:1]) if is_closed else np.diff(p, axis=0)
+			return float(np.hypot(d[:, 0], d[:, 1]).sum())
 	except Exception:
 		return 0.0
 	return 0.0
 
 
+# 线性类型排在最前，管线过滤用 types <= _SCAN_LINEAR_MAX 判断；其余类型编码为 255
+_SCAN_TYPES = ("LINE", "LWPOLYLINE", "POLYLINE", "CIRCLE", "ARC", "POINT", "INSERT")
+_SCAN_TYPE_CODE = {t: i for i, t in enumerate(_SCAN_TYPES)}
+_SCAN_LINEAR_MAX = 2
+
+
+def scan_entities(msp, doc: ezdxf.EzdxfDocument, green_aci: int) -> tuple[list, np.ndarray, np.ndarray, np.ndarray]:
+	"""
+	候选实体的唯一一次 msp 遍历（SoA）：跳过文字、颜色不符和无 bbox 的实体，
+	返回 (entities, bbox: float64[N,4], 长度: float64[N], 类型编码: uint8[N])，保持 msp 顺序。
+	"""
+	resolve = make_aci_resolver(doc)
+	entities: list = []
+	boxes: list[tuple[float, float, float, float]] = []
+	for e in msp:
+		if e.dxftype() in ("TEXT", "MTEXT"):
+			continue
+		if resolve(e) != green_aci:
+			continue
+		b = bbox2d(e)
+		if b is None:
+			continue
+		entities.append(e)
+		boxes.append(b)
+	n = len(entities)
+	box_arr = np.asarray(boxes, dtype=np.float64).reshape(n, 4)
+	lengths = np.fromiter((linear_length(e) for e in entities), dtype=np.float64, count=n)
+	types = np.fromiter((_SCAN_TYPE_CODE.get(e.dxftype(), 255) for e in entities), dtype=np.uint8, count=n)
+	return entities, box_arr, lengths, types
+
+
 def ensure_linetype(doc: ezdxf.EzdxfDocument, name: str) -> str:
 	try:
 		_ = doc.linetypes.get(name)
@@ -328,6 +792,73 @@ def draw_bbox(
 		return
 
 
+# 模板点云缓存版本：点云采样算法（如最远点下采样）或缓存字段变化时递增，旧缓存随之失效
+_TPL_CACHE_VERSION = 2
+# 从 blocks.dxf 现算模板点云时块的展开深度
+_TPL_FLATTEN_DEPTH = 2
+
+
+def template_cache_key(lib_blocks: Path, *, sample_div: float, max_points: int) -> str:
+	"""模板点云缓存键（JSON 串）：缓存版本、库文件与全部采样参数，任一不同即不复用。"""
+	return json.dumps(
+		{
+			"version": _TPL_CACHE_VERSION,
+			"lib": str(lib_blocks.resolve()),
+			"sample_div": float(sample_div),
+			"max_points": int(max_points),
+			"max_depth": _TPL_FLATTEN_DEPTH,
+		},
+		sort_keys=True,
+		ensure_ascii=False,
+	)
+
+
+def template_cache_path(cache_dir: Path, key: str) -> Path:
+	"""缓存文件名带版本号和键的摘要，不同库/参数的缓存可放在同一目录。"""
+	digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+	return cache_dir / f"tpl_cache_v{_TPL_CACHE_VERSION}_{digest}.npz"
+
+
+def load_template_cache(path: Path, *, newer_than: float, key: str) -> dict[str, tuple]:
+	"""读取模板点云缓存：name -> (bbox, norm, points)。缓存比库文件旧、键不一致或损坏时返回空。"""
+	try:
+		if path.stat().st_mtime < newer_than:
+			return {}
+		with np.load(path) as z:
+			if str(z["key"]) != key:
+				return {}
+			names = z["names"].tolist()
+			offsets = z["offsets"]
+			pts = z["pts"]
+			bbs = z["bbs"].tolist()
+			norms = z["norms"].tolist()
+	except Exception:
+		return {}
+	return {
+		name: (tuple(bbs[k]), norms[k], pts[offsets[k] : offsets[k + 1]])
+		for k, name in enumerate(names)
+	}
+
+
+def save_template_cache(path: Path, entries: dict[str, tuple], *, key: str) -> None:
+	names = list(entries)
+	all_pts = [np.asarray(entries[n][2], dtype=float).reshape(-1, 2) for n in names]
+	try:
+		path.parent.mkdir(parents=True, exist_ok=True)
+		np.savez(
+			path,
+			key=np.asarray(key),
+			names=np.asarray(names, dtype=str),
+			offsets=np.cumsum([0] + [len(p) for p in all_pts]),
+			pts=np.concatenate(all_pts) if all_pts else np.zeros((0, 2), dtype=float),
+			bbs=np.asarray([entries[n][0] for n in names], dtype=float).reshape(-1, 4),
+			norms=np.asarray([entries[n][1] for n in names], dtype=float),
+		)
+	except Exception:
+		# 缓存目录不可写等情况：不缓存即可
+		pass
+
+
 def compile_regex_list(patterns: list[str]) -> list["re.Pattern[str]"]:
 	out: list["re.Pattern[str]"] = []
 	for p in patterns:
@@ -338,6 +869,21 @@ def compile_regex_list(patterns: list[str]) -> list["re.Pattern[str]"]:
 	return out
 
 
+def combine_regex(rxs: list["re.Pattern[str]"]) -> list["re.Pattern[str]"]:
+	"""
+	多个正则合并为一个交替式，name_allowed 每个名字只需 search 一次。
+	含反向引用（分组编号会错位）或合并后无法编译时保持原列表。
+	"""
+	if len(rxs) < 2:
+		return rxs
+	if any(re.search(r"\\\d|\(\?P=", rx.pattern) for rx in rxs):
+		return rxs
+	try:
+		return [re.compile("|".join(f"(?:{rx.pattern})" for rx in rxs))]
+	except re.error:
+		return rxs
+
+
 def name_allowed(
 	name: str,
 	*,
@@ -393,10 +939,34 @@ def main() -> int:
 	parser.add_argument("--max-entities", type=int, default=200, help="单簇最大实体数（超过视为管线/大结构跳过）")
 	parser.add_argument("--max-size", type=float, default=500.0, help="单簇最大尺寸（bbox 边长阈值）")
 	parser.add_argument("--score-threshold", type=float, default=120.0, help="粗匹配阈值（descriptor_distance，越小越严格）")
+	parser.add_argument(
+		"--coarse-metric",
+		choices=("list", "hist"),
+		default="list",
+		help="粗匹配度量：list=排序量化列表逐项 L1（默认）；hist=定长直方图 L1，比较开销与元素数无关，阈值需重新设定",
+	)
 	parser.add_argument("--coarse-topk", type=int, default=5, help="粗匹配保留 TopK 后再做精匹配")
 	parser.add_argument("--sample-div", type=float, default=30.0, help="点云采样密度：max_dim / sample_div 作为步长")
 	parser.add_argument("--max-points", type=int, default=600, help="点云最大点数（下采样）")
+	parser.add_argument(
+		"--template-cache-dir",
+		default=None,
+		help="模板点云缓存目录（默认不缓存）：缓存从 blocks.dxf 现算的模板点云，按库文件与采样参数区分，库文件更新或缓存版本变化后自动失效",
+	)
 	parser.add_argument("--chamfer-threshold", type=float, default=0.06, help="精匹配阈值（Chamfer 距离，越小越严格）")
+	parser.add_argument(
+		"--canonical-orient",
+		action=argparse.BooleanOptionalAction,
+		default=False,
+		help="精匹配先按点云主方向对齐，只尝试 2 个旋转角（主方向不明确时仍试全部角度）；更快但可能选错方向",
+	)
+	parser.add_argument("--jobs", type=int, default=1, help="并行进程数（>1 时各簇的粗/精匹配分给进程池，替换仍在主进程串行）")
+	parser.add_argument(
+		"--fine-threads",
+		type=int,
+		default=0,
+		help="精匹配按模板分组、用线程并行（match_batch）的线程数；0 关闭（默认，逐簇串行并做下界剪枝），-1 为 CPU 核数；--jobs>1 时不生效",
+	)
 	parser.add_argument(
 		"--include-symbol",
 		action="append",
@@ -465,8 +1035,8 @@ def main() -> int:
 
 	include_names = {str(x).strip() for x in (args.include_symbol or []) if str(x).strip()}
 	exclude_names = {str(x).strip() for x in (args.exclude_symbol or []) if str(x).strip()}
-	include_regex = compile_regex_list(list(args.include_regex or []))
-	exclude_regex = compile_regex_list(list(args.exclude_regex or []))
+	include_regex = combine_regex(compile_regex_list(list(args.include_regex or [])))
+	exclude_regex = combine_regex(compile_regex_list(list(args.exclude_regex or [])))
 
 	library: list[tuple[str, SymbolDescriptor]] = []
 	symbol_meta: dict[str, dict] = {}
@@ -486,9 +1056,19 @@ def main() -> int:
 
 	if not library:
 		raise SystemExit("符号库为空（index.json 未包含 symbols）")
-
-	# 预计算模板点云（精匹配）
+	# 粗匹配用：库描述子堆成矩阵，每簇一次向量化算完全部距离
+	library_stack = stack_descriptors([d for _, d in library])
+
+	# 预计算模板点云（精匹配）；指定 --template-cache-dir 时，从 blocks.dxf 现算的模板按库文件与采样参数缓存
+	tpl_cache_key = template_cache_key(lib_blocks, sample_div=args.sample_div, max_points=args.max_points)
+	tpl_cache_path = template_cache_path(Path(args.template_cache_dir), tpl_cache_key) if args.template_cache_dir else None
+	tpl_cached: dict[str, tuple] = {}
+	tpl_fresh: dict[str, tuple] = {}
+	if tpl_cache_path is not None:
+		lib_mtime = max(lib_blocks.stat().st_mtime, lib_index.stat().st_mtime)
+		tpl_cached = load_template_cache(tpl_cache_path, newer_than=lib_mtime, key=tpl_cache_key)
 	template_points: dict[str, dict] = {}
+	lib_flatten_cache: dict = {}
 	for block_name, desc in library:
 		meta = symbol_meta.get(block_name) or {}
 
@@ -501,17 +1081,20 @@ def main() -> int:
 			else:
 				bb = None
 			norm = float(meta.get("norm") or (max(bb[2] - bb[0], bb[3] - bb[1]) if bb else 1.0) or 1.0)
+		elif block_name in tpl_cached:
+			bb, norm, pts = tpl_cached[block_name]
 		else:
 			try:
 				blk = lib_doc.blocks.get(block_name)
 			except Exception:
 				continue
-			flat = flatten_entities(list(blk), lib_doc, max_depth=2)
-			bb = bbox_of_entities(flat)
+			geoms = flatten_geometry(list(blk), lib_doc, max_depth=_TPL_FLATTEN_DEPTH, cache=lib_flatten_cache)
+			bb = bbox_of_geometry(geoms)
 			if bb is None:
 				continue
-			pts = point_cloud_from_entities(flat, bb, sample_div=args.sample_div, max_points=args.max_points)
+			pts = point_cloud_from_geometry(geoms, bb, sample_div=args.sample_div, max_points=args.max_points)
 			norm = float(max(bb[2] - bb[0], bb[3] - bb[1]) or 1.0)
+			tpl_fresh[block_name] = (bb, norm, pts)
 
 		if bb is None:
 			# 没有 bbox 则无法换算比例
@@ -521,37 +1104,25 @@ def main() -> int:
 			"bbox": bb,
 			"norm": norm,
 			"points": pts,
+			"radii": radial_profile(pts),
+			"tree": point_tree(pts),
 		}
+	if tpl_fresh and tpl_cache_path is not None:
+		save_template_cache(tpl_cache_path, {**tpl_cached, **tpl_fresh}, key=tpl_cache_key)
 
 	doc = ezdxf.readfile(args.input_dxf)
 	msp = doc.modelspace()
 
-	# 选取候选实体
-	cand_entities: list = []
-	cand_boxes: list[tuple[float, float, float, float]] = []
-	cand_lengths: list[float] = []
-	for e in msp:
-		if e.dxftype() in ("TEXT", "MTEXT"):
-			continue
-		if resolved_aci(e, doc) != args.green_aci:
-			continue
-		b = bbox2d(e)
-		if b is None:
-			continue
-		cand_entities.append(e)
-		cand_boxes.append(b)
-		cand_lengths.append(linear_length(e))
+	# 选取候选实体：一次遍历物化为 SoA，管线过滤用 numpy 掩码
+	cand_entities, boxes_np, lengths_np, types_np = scan_entities(msp, doc, int(args.green_aci))
 
 	print(f"候选绿色实体数：{len(cand_entities)}")
 
 	# 先过滤“疑似管线”：把特别长的线性实体从聚类候选里剔除（但不会删除它们）
 	pipe_filter_info: dict = {"enabled": bool(args.filter_pipes)}
 	if args.filter_pipes:
-		lengths = [l for l in cand_lengths if l > 1e-9]
-		if lengths:
-			import numpy as np
-
-			arr = np.asarray(lengths, dtype=float)
+		arr = lengths_np[lengths_np > 1e-9]
+		if len(arr):
 			med = float(np.median(arr))
 			q = float(np.quantile(arr, float(args.pipe_length_quantile)))
 			auto_threshold = max(float(args.pipe_min_length), med * float(args.pipe_median_factor), q)
@@ -566,23 +1137,19 @@ def main() -> int:
 				}
 			)
 
-			keep_entities: list = []
-			keep_boxes: list[tuple[float, float, float, float]] = []
-			keep_lengths: list[float] = []
-			removed = 0
-			for e, b, ln in zip(cand_entities, cand_boxes, cand_lengths):
-				if ln > 1e-9 and ln >= threshold and e.dxftype() in ("LINE", "LWPOLYLINE", "POLYLINE"):
-					removed += 1
-					continue
-				keep_entities.append(e)
-				keep_boxes.append(b)
-				keep_lengths.append(ln)
-			cand_entities, cand_boxes, cand_lengths = keep_entities, keep_boxes, keep_lengths
+			drop = (lengths_np > 1e-9) & (lengths_np >= threshold) & (types_np <= _SCAN_LINEAR_MAX)
+			keep = np.flatnonzero(~drop)
+			cand_entities = [cand_entities[i] for i in keep.tolist()]
+			boxes_np = boxes_np[keep]
+			lengths_np = lengths_np[keep]
+			removed = int(drop.sum())
 			pipe_filter_info["removed"] = removed
 			print(f"管线过滤：阈值≈{threshold:.3f}，剔除 {removed} 条线性实体，剩余 {len(cand_entities)}")
 		else:
 			pipe_filter_info["note"] = "未找到线性实体长度样本"
 
+	cand_boxes: list[tuple[float, float, float, float]] = [tuple(b) for b in boxes_np.tolist()]
+
 	if args.cluster_method == "connect":
 		tol = float(args.connect_tol) if args.connect_tol is not None else float(args.cluster_tol)
 		clusters = cluster_entities_connectivity(
@@ -654,13 +1221,21 @@ def main() -> int:
 	importer = Importer(lib_doc, doc) if args.replace else None
 	imported_map: dict[str, str] = {}  # 仅在 replace 时使用
 
+	# 线型/图层在循环前解析一次，循环内直接用解析结果
+	seg_lt = "CONTINUOUS"
 	if args.draw_seg_bbox:
-		lt = ensure_linetype(doc, str(args.seg_bbox_linetype))
-		ensure_layer(doc, str(args.seg_bbox_layer), color=int(args.seg_bbox_color), linetype=lt)
+		seg_lt = ensure_linetype(doc, str(args.seg_bbox_linetype))
+		ensure_layer(doc, str(args.seg_bbox_layer), color=int(args.seg_bbox_color), linetype=seg_lt)
 
+	bbox_lt = "CONTINUOUS"
 	if args.draw_bbox:
-		lt = ensure_linetype(doc, str(args.bbox_linetype))
-		ensure_layer(doc, str(args.bbox_layer), color=int(args.bbox_color), linetype=lt)
+		try:
+			bbox_lt = ensure_linetype(doc, str(args.bbox_linetype))
+		except Exception:
+			bbox_lt = "CONTINUOUS"
+		ensure_layer(doc, str(args.bbox_layer), color=int(args.bbox_color), linetype=bbox_lt)
+	# seg_doc 上的识别 bbox 图层/线型在首次命中时才建，没有命中时 seg_doc 不多出图层
+	seg_doc_bbox_lt: Optional[str] = None
 
 	matched = 0
 	replaced = 0
@@ -678,13 +1253,12 @@ def main() -> int:
 			)
 
 			if args.draw_seg_bbox:
-				lt = ensure_linetype(doc, str(args.seg_bbox_linetype))
 				draw_bbox(
 					msp,
 					bb,
 					layer=str(args.seg_bbox_layer),
 					color=int(args.seg_bbox_color),
-					linetype=lt,
+					linetype=seg_lt,
 					ltscale=float(args.seg_bbox_ltscale),
 				)
 				if args.seg_label:
@@ -731,52 +1305,51 @@ def main() -> int:
 		"clusters_total": len(clusters),
 		"replacements": [],
 	}
+	# 候选实体的图层编码成整数一次算好，簇内多数层用 bincount 取
+	cand_layer_names, cand_layer_codes = np.unique(
+		np.array([str(getattr(e.dxf, "layer", "0")) for e in cand_entities] or ["0"], dtype=object),
+		return_inverse=True,
+	)
+	# 几何参数在主进程一次取出（ezdxf 实体不可 pickle）；替换前各簇互不相交，先全部取出不影响结果
+	work: list[tuple[Cluster, list]] = []
+	flatten_cache: dict = {}
 	for cl in eligible_clusters:
 		if len(cl.indices) > args.max_entities:
 			continue
-
 		ents = [cand_entities[i] for i in cl.indices]
-		flat = flatten_entities(ents, doc, max_depth=2)
-		bb = bbox_of_entities(flat)
-		if bb is None:
+		# 展开后的实体只读一次几何参数，bbox/描述子/点云都复用这份结果
+		work.append((cl, flatten_geometry(ents, doc, max_depth=2, cache=flatten_cache)))
+
+	match_ctx = {
+		"library_names": [name for name, _ in library],
+		"library_stack": library_stack,
+		"template_points": template_points,
+		"max_size": float(args.max_size),
+		"score_threshold": float(args.score_threshold),
+		"coarse_metric": args.coarse_metric,
+		"coarse_topk": int(args.coarse_topk),
+		"sample_div": float(args.sample_div),
+		"max_points": int(args.max_points),
+		"chamfer_threshold": float(args.chamfer_threshold),
+		"use_canonical": bool(args.canonical_orient),
+	}
+	jobs = max(1, int(args.jobs))
+	if jobs > 1 and len(work) > 1:
+		jobs = min(jobs, len(work))
+		with ProcessPoolExecutor(max_workers=jobs, initializer=_init_match_worker, initargs=(match_ctx,)) as ex:
+			results = list(ex.map(_match_worker, [g for _, g in work], chunksize=max(1, len(work) // (jobs * 4))))
+	elif args.fine_threads != 0:
+		results = match_clusters_by_template([g for _, g in work], match_ctx, n_jobs=int(args.fine_threads))
+	else:
+		results = [match_cluster(g, match_ctx) for _, g in work]
+
+	for (cl, geoms), res in zip(work, results):
+		if res is None:
 			continue
+		bb, best_name, best_coarse, best_chamfer, best_angle = res
+		ents = [cand_entities[i] for i in cl.indices]
 		minx, miny, maxx, maxy = bb
 		size = max(maxx - minx, maxy - miny)
-		if size > args.max_size:
-			continue
-
-		desc = compute_descriptor(flat, bb)
-
-		# 粗匹配：descriptor_distance TopK
-		candidates = []
-		for name, lib_desc in library:
-			s = descriptor_distance(desc, lib_desc)
-			if s <= args.score_threshold:
-				candidates.append((s, name))
-		if not candidates:
-			continue
-		candidates.sort(key=lambda x: x[0])
-		candidates = candidates[: max(1, args.coarse_topk)]
-
-		# 精匹配：Chamfer Distance + 旋转
-		cand_pts = point_cloud_from_entities(flat, bb, sample_div=args.sample_div, max_points=args.max_points)
-		best_name: Optional[str] = None
-		best_coarse = float("inf")
-		best_chamfer = float("inf")
-		best_angle = 0.0
-		for coarse_score, name in candidates:
-			tpl = template_points.get(name)
-			if tpl is None:
-				continue
-			ch_score, angle = chamfer_best_rotation(tpl["points"], cand_pts)
-			if ch_score < best_chamfer:
-				best_chamfer = ch_score
-				best_name = name
-				best_coarse = coarse_score
-				best_angle = angle
-
-		if best_name is None or best_chamfer > args.chamfer_threshold:
-			continue
 
 		matched += 1
 
@@ -794,13 +1367,10 @@ def main() -> int:
 			scale = 1.0
 			rotation = 0.0
 
-		# 尽量保持原层
-		try:
-			from collections import Counter
-
-			layer = Counter(getattr(e.dxf, "layer", "0") for e in ents).most_common(1)[0][0]
-		except Exception:
-			layer = "0"
+		# 尽量保持原层；并列时取簇内先出现的层（与 Counter.most_common 一致）
+		codes = cand_layer_codes[cl.indices]
+		counts = np.bincount(codes)
+		layer = str(cand_layer_names[codes[np.argmax(counts[codes] == counts.max())]])
 
 		if args.replace and importer is not None:
 			# 导入 block（避免名称冲突）
@@ -830,32 +1400,28 @@ def main() -> int:
 			replaced += 1
 
 		if args.draw_bbox:
-			lt = str(args.bbox_linetype)
-			try:
-				lt = ensure_linetype(doc, lt)
-			except Exception:
-				lt = "CONTINUOUS"
 			draw_bbox(
 				msp,
 				(minx, miny, maxx, maxy),
 				layer=str(args.bbox_layer),
 				color=int(args.bbox_color),
-				linetype=lt,
+				linetype=bbox_lt,
 				ltscale=float(args.bbox_ltscale),
 			)
 			# 同步在 seg_doc 上画识别 bbox（如果启用）
 			if seg_doc is not None and seg_msp is not None:
-				try:
-					lt2 = ensure_linetype(seg_doc, lt)
-				except Exception:
-					lt2 = "CONTINUOUS"
-				ensure_layer(seg_doc, str(args.bbox_layer), color=int(args.bbox_color), linetype=lt2)
+				if seg_doc_bbox_lt is None:
+					try:
+						seg_doc_bbox_lt = ensure_linetype(seg_doc, bbox_lt)
+					except Exception:
+						seg_doc_bbox_lt = "CONTINUOUS"
+					ensure_layer(seg_doc, str(args.bbox_layer), color=int(args.bbox_color), linetype=seg_doc_bbox_lt)
 				draw_bbox(
 					seg_msp,
 					(minx, miny, maxx, maxy),
 					layer=str(args.bbox_layer),
 					color=int(args.bbox_color),
-					linetype=lt2,
+					linetype=seg_doc_bbox_lt,
 					ltscale=float(args.bbox_ltscale),
 				)
 
@@ -872,7 +1438,7 @@ def main() -> int:
 				"insert_point": [insert_point[0], insert_point[1]],
 				"bbox": [minx, miny, maxx, maxy],
 				"entity_count": len(ents),
-				"flat_entity_count": len(flat),
+				"flat_entity_count": len(geoms),
 			}
 		)
 
@@ -8,16 +8,67 @@ import json
 import math
 import re
 import zlib
+from bisect import bisect_right
 from collections import Counter
 from dataclasses import dataclass
+from functools import cached_property
+from itertools import accumulate
 from pathlib import Path
 from typing import Any, Iterable, Optional
 
 import ezdxf
 
+try:
+	import orjson
+	# 索引中混有 numpy 标量（json 视其为 float 子类，orjson 需显式开启）
+	_ORJSON_OPTS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+except Exception:
+	orjson = None
+
+try:
+	# zstandard 可选：点云可改用 zstd 压缩（encoding=zstd-base64-int16），默认仍为 zlib
+	import zstandard as zstd  # type: ignore[import-not-found]
+except Exception:
+	zstd = None
+
+try:
+	# numba 可选：点云采样内核 JIT 编译（numba 依赖 numpy，二者一起导入）
+	import numpy as np
+	from numba import njit  # type: ignore[import-not-found]
+except Exception:
+	njit = None
+
 HAN_RE = re.compile(r"[\u4e00-\u9fff]")
 
 
+def has_han(text: str) -> bool:
+	"""是否含中文（CJK 统一汉字）。纯 ASCII 字符串 isascii() 为 O(1)，直接跳过正则。"""
+	return not text.isascii() and HAN_RE.search(text) is not None
+
+
+def han_flags(texts: list[str]) -> list[bool]:
+	"""
+	批量判断每个字符串是否含中文：用不会出现在名称中的分隔符拼接后整体扫描，
+	每命中一次直接跳到下一个字符串的起点，正则调用次数不超过“含中文的字符串个数 + 1”。
+	"""
+	flags = [False] * len(texts)
+	if not texts:
+		return flags
+	starts = list(accumulate((len(t) + 1 for t in texts[:-1]), initial=0))
+	joined = "\x01".join(texts)
+	pos = 0
+	while True:
+		m = HAN_RE.search(joined, pos)
+		if m is None:
+			break
+		k = bisect_right(starts, m.start()) - 1
+		flags[k] = True
+		if k + 1 >= len(texts):
+			break
+		pos = starts[k + 1]
+	return flags
+
+
 def resolved_aci(entity, doc: ezdxf.EzdxfDocument, fallback: int = 7) -> int:
 	"""解析实体的最终 ACI 颜色（简化版：处理 BYLAYER/BYBLOCK）。"""
 	color = getattr(entity.dxf, "color", 256)
@@ -33,6 +84,26 @@ def resolved_aci(entity, doc: ezdxf.EzdxfDocument, fallback: int = 7) -> int:
 	return int(color)
 
 
+def make_aci_resolver(doc: ezdxf.EzdxfDocument, fallback: int = 7):
+	"""
+	返回带图层缓存的 resolved_aci：BYLAYER/BYBLOCK 实体按图层名记忆结果，
+	图层表只查一次（图层通常几十个，实体成千上万）。
+	"""
+	layer_aci: dict[str, int] = {}
+
+	def resolve(entity) -> int:
+		color = getattr(entity.dxf, "color", 256)
+		if color not in (None, 0, 256):
+			return int(color)
+		layer = entity.dxf.layer
+		aci = layer_aci.get(layer)
+		if aci is None:
+			aci = layer_aci[layer] = resolved_aci(entity, doc, fallback)
+		return aci
+
+	return resolve
+
+
 def bbox2d(entity) -> Optional[tuple[float, float, float, float]]:
 	"""计算 2D 外包框（覆盖图例常见实体类型）。返回 (minx,miny,maxx,maxy)。"""
 	t = entity.dxftype()
@@ -40,7 +111,14 @@ def bbox2d(entity) -> Optional[tuple[float, float, float, float]]:
 		if t == "LINE":
 			s = entity.dxf.start
 			e = entity.dxf.end
-			return (min(s.x, e.x), min(s.y, e.y), max(s.x, e.x), max(s.y, e.y))
+			x0, y0, x1, y1 = s.x, s.y, e.x, e.y
+			# 两数比较用条件表达式：与 min()/max() 结果相同（相等时取前者），省去内建函数调用
+			return (
+				x1 if x1 < x0 else x0,
+				y1 if y1 < y0 else y0,
+				x1 if x1 > x0 else x0,
+				y1 if y1 > y0 else y0,
+			)
 		if t == "CIRCLE":
 			c = entity.dxf.center
 			r = float(entity.dxf.radius)
@@ -59,24 +137,95 @@ def bbox2d(entity) -> Optional[tuple[float, float, float, float]]:
 			p = entity.dxf.insert
 			return (p.x, p.y, p.x, p.y)
 		if t == "LWPOLYLINE":
-			pts = list(entity.get_points("xy"))
-			if not pts:
+			# lwpoints.values 是 (N,5) 的 numpy 数组（x, y, start_width, end_width, bulge），
+			# 直接取列比 get_points() 逐点构造元组快一个数量级
+			v = entity.lwpoints.values  # type: ignore[attr-defined]
+			if not len(v):
 				return None
-			xs = [p[0] for p in pts]
-			ys = [p[1] for p in pts]
+			xs = v[:, 0].tolist()
+			ys = v[:, 1].tolist()
 			return (min(xs), min(ys), max(xs), max(ys))
 		if t == "POLYLINE":
 			pts = [v.dxf.location for v in entity.vertices]  # type: ignore[attr-defined]
 			if not pts:
 				return None
-			xs = [p.x for p in pts]
-			ys = [p.y for p in pts]
+			xs, ys, _ = zip(*pts)
 			return (min(xs), min(ys), max(xs), max(ys))
 	except Exception:
 		return None
 	return None
 
 
+def entity_geometry(entity) -> tuple[str, Any]:
+	"""
+	一次读出实体的 2D 几何参数，bbox/描述子/点云采样都从这里取值，不再各自访问 DXF 属性：
+	- LINE: (x0, y0, x1, y1)
+	- CIRCLE: (cx, cy, r)；ARC: (cx, cy, r, start_angle, end_angle)，角度为度
+	- POINT/TEXT/MTEXT/INSERT: (x, y)
+	- LWPOLYLINE/POLYLINE: (顶点列表, 是否闭合)
+	返回 (dxftype, 几何)；不支持的类型或读取失败时几何为 None。
+	"""
+	t = entity.dxftype()
+	try:
+		if t == "LINE":
+			s = entity.dxf.start
+			e = entity.dxf.end
+			return t, (float(s.x), float(s.y), float(e.x), float(e.y))
+		if t == "CIRCLE":
+			c = entity.dxf.center
+			return t, (float(c.x), float(c.y), float(entity.dxf.radius))
+		if t == "ARC":
+			c = entity.dxf.center
+			return t, (
+				float(c.x),
+				float(c.y),
+				float(entity.dxf.radius),
+				float(entity.dxf.start_angle),
+				float(entity.dxf.end_angle),
+			)
+		if t == "POINT":
+			p = entity.dxf.location
+			return t, (float(p.x), float(p.y))
+		if t in ("TEXT", "MTEXT", "INSERT"):
+			p = entity.dxf.insert
+			return t, (float(p.x), float(p.y))
+		if t == "LWPOLYLINE":
+			pts = entity.lwpoints.values[:, 0:2].tolist()  # type: ignore[attr-defined]
+			return t, (pts, bool(getattr(entity, "closed", False)))
+		if t == "POLYLINE":
+			pts = [[float(v.dxf.location.x), float(v.dxf.location.y)] for v in entity.vertices]  # type: ignore[attr-defined]
+			return t, (pts, bool(getattr(entity, "is_closed", False)))
+	except Exception:
+		return t, None
+	return t, None
+
+
+def geometry_bbox(t: str, g: Any) -> Optional[tuple[float, float, float, float]]:
+	"""entity_geometry 结果的外包框，与 bbox2d 一致。"""
+	if g is None:
+		return None
+	if t == "LINE":
+		x0, y0, x1, y1 = g
+		# 同 bbox2d：条件表达式代替两参数 min()/max()
+		return (
+			x1 if x1 < x0 else x0,
+			y1 if y1 < y0 else y0,
+			x1 if x1 > x0 else x0,
+			y1 if y1 > y0 else y0,
+		)
+	if t in ("CIRCLE", "ARC"):
+		cx, cy, r = g[0], g[1], g[2]
+		return (cx - r, cy - r, cx + r, cy + r)
+	if t in ("LWPOLYLINE", "POLYLINE"):
+		pts = g[0]
+		if not pts:
+			return None
+		xs, ys = zip(*pts)
+		return (min(xs), min(ys), max(xs), max(ys))
+	x, y = g
+	return (x, y, x, y)
+
+
 def merge_bbox(bboxes: Iterable[tuple[float, float, float, float]]) -> Optional[tuple[float, float, float, float]]:
 	it = iter(bboxes)
 	try:
@@ -84,10 +233,15 @@ def merge_bbox(bboxes: Iterable[tuple[float, float, float, float]]) -> Optional[
 	except StopIteration:
 		return None
 	for bx0, by0, bx1, by1 in it:
-		minx = min(minx, bx0)
-		miny = min(miny, by0)
-		maxx = max(maxx, bx1)
-		maxy = max(maxy, by1)
+		# 等价于 min()/max() 两参数形式（只在严格更小/更大时替换）
+		if bx0 < minx:
+			minx = bx0
+		if by0 < miny:
+			miny = by0
+		if bx1 > maxx:
+			maxx = bx1
+		if by1 > maxy:
+			maxy = by1
 	return (minx, miny, maxx, maxy)
 
 
@@ -105,12 +259,22 @@ def normalize_angle_pi(angle: float) -> float:
 	return angle
 
 
+# sanitize_name：顿号、全部 Unicode 空白（与 re 的 \s / str.isspace 一致）及文件名非法字符一次 translate 成 "_"
+_SANITIZE_TABLE = str.maketrans(
+	dict.fromkeys(
+		"\u3001"
+		'<>/\\:;"?*|=,'
+		"\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005"
+		"\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000",
+		"_",
+	)
+)
+_MULTI_UNDERSCORE_RE = re.compile(r"_+")
+
+
 def sanitize_name(name: str, max_len: int = 80) -> str:
-	n = name.strip()
-	n = n.replace("\u3001", "_")  # 顿号
-	n = re.sub(r"\s+", "_", n)
-	n = re.sub(r'[<>/\\\\:;\"?*|=,]', "_", n)
-	n = re.sub(r"_+", "_", n).strip("_")
+	n = name.strip().translate(_SANITIZE_TABLE)
+	n = _MULTI_UNDERSCORE_RE.sub("_", n).strip("_")
 	if not n:
 		n = "SYM"
 	if len(n) > max_len:
@@ -129,6 +293,37 @@ class SymbolDescriptor:
 	# 归一化尺寸（量化）
 	size_q: tuple[int, int]
 
+	# 量化列表的 int64 数组，首次使用时生成并缓存（cached_property 直接写 __dict__，frozen 也可用）
+	@cached_property
+	def counts_np(self) -> "Any":
+		"""counts 按 _DESC_COUNT_KEYS 顺序排成的定长数组；counts 字典仍用于序列化。"""
+		import numpy as np
+
+		return np.array([self.counts.get(k, 0) for k in _DESC_COUNT_KEYS], dtype=np.int64)
+
+	@cached_property
+	def lengths_np(self) -> "Any":
+		import numpy as np
+
+		return np.asarray(self.lengths_q, dtype=np.int64)
+
+	@cached_property
+	def angles_np(self) -> "Any":
+		import numpy as np
+
+		return np.asarray(self.angles_q, dtype=np.int64)
+
+	@cached_property
+	def radii_np(self) -> "Any":
+		import numpy as np
+
+		return np.asarray(self.radii_q, dtype=np.int64)
+
+	@cached_property
+	def hist_np(self) -> "Any":
+		"""lengths/angles/radii 三段定长直方图拼接，见 descriptor_histogram。"""
+		return descriptor_histogram(self)
+
 	def to_dict(self) -> dict[str, Any]:
 		return {
 			"counts": self.counts,
@@ -156,6 +351,23 @@ def compute_descriptor(
 	length_step: float = 0.01,
 	radius_step: float = 0.01,
 	angle_step_deg: float = 5.0,
+) -> SymbolDescriptor:
+	return descriptor_from_geometry(
+		[entity_geometry(e) for e in entities],
+		bbox,
+		length_step=length_step,
+		radius_step=radius_step,
+		angle_step_deg=angle_step_deg,
+	)
+
+
+def descriptor_from_geometry(
+	geoms: list[tuple[str, Any]],
+	bbox: tuple[float, float, float, float],
+	*,
+	length_step: float = 0.01,
+	radius_step: float = 0.01,
+	angle_step_deg: float = 5.0,
 ) -> SymbolDescriptor:
 	minx, miny, maxx, maxy = bbox
 	width = maxx - minx
@@ -164,75 +376,53 @@ def compute_descriptor(
 	if not math.isfinite(norm) or norm <= 0:
 		norm = 1.0
 
+	import numpy as np
+
 	counts: Counter[str] = Counter()
-	lengths: list[tuple[float, float]] = []  # (len, angle)
+	segs: list[tuple[float, float, float, float]] = []
 	radii: list[float] = []
 
-	# 收集原始特征
-	for e in entities:
-		t = e.dxftype()
+	# 收集原始坐标；长度/角度/量化在循环外用 numpy 一次算完
+	for t, g in geoms:
 		counts[t] += 1
+		if g is None:
+			continue
 
 		if t == "LINE":
-			s = e.dxf.start
-			en = e.dxf.end
-			dx = float(en.x - s.x)
-			dy = float(en.y - s.y)
-			ln = math.hypot(dx, dy)
-			if ln <= 1e-9:
-				continue
-			ang = normalize_angle_pi(math.atan2(dy, dx))
-			lengths.append((ln / norm, ang))
-		elif t == "CIRCLE":
-			r = float(e.dxf.radius)
-			if r > 0:
-				radii.append(r / norm)
-		elif t == "ARC":
-			r = float(e.dxf.radius)
+			segs.append(g)
+		elif t in ("CIRCLE", "ARC"):
+			r = g[2]
 			if r > 0:
-				radii.append(r / norm)
+				radii.append(r)
 		elif t in ("LWPOLYLINE", "POLYLINE"):
-			try:
-				if t == "LWPOLYLINE":
-					pts = list(e.get_points("xy"))
-					pts = [(float(p[0]), float(p[1])) for p in pts]
-					is_closed = bool(getattr(e, "closed", False))
-				else:
-					vs = [v.dxf.location for v in e.vertices]  # type: ignore[attr-defined]
-					pts = [(float(p.x), float(p.y)) for p in vs]
-					is_closed = bool(getattr(e, "is_closed", False))
-			except Exception:
-				continue
-
+			pts, is_closed = g
 			if len(pts) < 2:
 				continue
 			seq = pts + ([pts[0]] if is_closed else [])
-			for (x0, y0), (x1, y1) in zip(seq, seq[1:]):
-				dx = x1 - x0
-				dy = y1 - y0
-				ln = math.hypot(dx, dy)
-				if ln <= 1e-9:
-					continue
-				ang = normalize_angle_pi(math.atan2(dy, dx))
-				lengths.append((ln / norm, ang))
-
-	# 旋转归一：用“最长线段”的方向作为参考
-	ref_angle = 0.0
-	if lengths:
-		ref_angle = max(lengths, key=lambda x: x[0])[1]
-
-	angle_step = math.radians(angle_step_deg)
-	lengths_q: list[int] = []
-	angles_q: list[int] = []
-	for ln, ang in lengths:
-		lengths_q.append(quantize(ln, length_step))
-		angles_q.append(quantize(normalize_angle_pi(ang - ref_angle), angle_step))
-
-	radii_q = [quantize(r, radius_step) for r in radii]
-
-	lengths_q.sort()
-	angles_q.sort()
-	radii_q.sort()
+			segs.extend((x0, y0, x1, y1) for (x0, y0), (x1, y1) in zip(seq, seq[1:]))
+
+	def quantize_sorted(values: Any, step: float) -> list[int]:
+		if not len(values):
+			return []
+		if step <= 0:
+			raise ValueError("step must be > 0")
+		# np.rint 与 round() 一样是四舍六入五成双
+		return np.sort(np.rint(values / step).astype(np.int64)).tolist()
+
+	seg = np.asarray(segs, dtype=np.float64).reshape(len(segs), 4)
+	dx = seg[:, 2] - seg[:, 0]
+	dy = seg[:, 3] - seg[:, 1]
+	ln = np.hypot(dx, dy)
+	keep = ln > 1e-9
+	lengths = ln[keep] / norm
+	angles = np.mod(np.arctan2(dy[keep], dx[keep]), math.pi)
+
+	# 旋转归一：用“最长线段”的方向作为参考（并列取第一条）
+	ref_angle = float(angles[np.argmax(lengths)]) if len(lengths) else 0.0
+
+	lengths_q = quantize_sorted(lengths, length_step)
+	angles_q = quantize_sorted(np.mod(angles - ref_angle, math.pi), math.radians(angle_step_deg))
+	radii_q = quantize_sorted(np.asarray(radii, dtype=np.float64) / norm, radius_step)
 
 	size_q = (quantize(width / norm, 0.01), quantize(height / norm, 0.01))
 
@@ -245,45 +435,238 @@ def compute_descriptor(
 	)
 
 
+# descriptor_distance 中公共前缀长度达到该值时改用 numpy 计算 L1 距离
+_LIST_DIST_NUMPY_MIN = 40
+
+
 def descriptor_distance(a: SymbolDescriptor, b: SymbolDescriptor) -> float:
-	# 计数作为硬约束的软惩罚：差 1 个就很大
+	import numpy as np
+
+	# 计数作为硬约束的软惩罚：差 1 个就很大。
+	# 单对比较时 6 次 dict.get 比 counts_np 的 numpy 调用更快，批量比较见 descriptor_distance_batch
 	score = 0.0
-	for k in ("LINE", "CIRCLE", "ARC", "LWPOLYLINE", "POLYLINE", "INSERT"):
+	for k in _DESC_COUNT_KEYS:
 		da = a.counts.get(k, 0)
 		db = b.counts.get(k, 0)
 		score += abs(da - db) * 50.0
 
-	def list_dist(x: list[int], y: list[int], w: float) -> float:
+	def list_dist(x: list[int], y: list[int], xv: "Any", yv: "Any", w: float) -> float:
 		if not x and not y:
 			return 0.0
 		if not x or not y:
 			return w * 200.0 + abs(len(x) - len(y)) * w * 10.0
 		n = min(len(x), len(y))
-		d = sum(abs(x[i] - y[i]) for i in range(n))
+		if n < _LIST_DIST_NUMPY_MIN:
+			d = sum(abs(x[i] - y[i]) for i in range(n))
+		else:
+			# 长列表用缓存的 int64 数组整段求 L1，短列表 numpy 调用开销反而更大
+			d = int(np.abs(xv[:n] - yv[:n]).sum())
 		d += abs(len(x) - len(y)) * 20
 		return d * w
 
-	score += list_dist(a.lengths_q, b.lengths_q, 1.0)
-	score += list_dist(a.radii_q, b.radii_q, 2.0)
-	score += list_dist(a.angles_q, b.angles_q, 0.5)
+	score += list_dist(a.lengths_q, b.lengths_q, a.lengths_np, b.lengths_np, 1.0)
+	score += list_dist(a.radii_q, b.radii_q, a.radii_np, b.radii_np, 2.0)
+	score += list_dist(a.angles_q, b.angles_q, a.angles_np, b.angles_np, 0.5)
 
 	# 尺寸差异（归一后仍可用于区分）
 	score += (abs(a.size_q[0] - b.size_q[0]) + abs(a.size_q[1] - b.size_q[1])) * 5.0
 	return score
 
 
+_DESC_COUNT_KEYS = ("LINE", "CIRCLE", "ARC", "LWPOLYLINE", "POLYLINE", "INSERT")
+
+# 直方图描述子：(字段, 分箱数, 箱宽（量化单位）, 权重)。长度/半径超出末箱的并入末箱；
+# 角度按 5° 量化共 36 箱，量化值 36（即 180°）与 0 同向，取模并入第 0 箱
+_HIST_SPEC = (
+	("lengths_q", 64, 2, 1.0),
+	("angles_q", 36, 1, 0.5),
+	("radii_q", 64, 2, 2.0),
+)
+
+
+def descriptor_histogram(desc: SymbolDescriptor) -> "Any":
+	"""
+	把量化列表转成定长直方图（int64，按 _HIST_SPEC 顺序拼接）。
+	直方图间的 L1 与元素个数无关、可交换，比较开销固定，不需要 list_dist 的长度差惩罚。
+	"""
+	import numpy as np
+
+	parts = []
+	for f, nbins, width, _ in _HIST_SPEC:
+		q = np.asarray(getattr(desc, f), dtype=np.int64) // width
+		q = q % nbins if f == "angles_q" else np.clip(q, 0, nbins - 1)
+		parts.append(np.bincount(q, minlength=nbins))
+	return np.concatenate(parts)
+
+
+def _hist_weights() -> "Any":
+	import numpy as np
+
+	return np.concatenate([np.full(nbins, w) for _, nbins, _, w in _HIST_SPEC])
+
+
+def descriptor_distance_hist(a: SymbolDescriptor, b: SymbolDescriptor) -> float:
+	"""
+	直方图版 descriptor_distance：计数与尺寸项相同，三个量化列表改为直方图加权 L1。
+	与列表版量纲不同，阈值需单独设定。
+	"""
+	import numpy as np
+
+	score = 0.0
+	for k in _DESC_COUNT_KEYS:
+		score += abs(a.counts.get(k, 0) - b.counts.get(k, 0)) * 50.0
+	score += float((np.abs(a.hist_np - b.hist_np) * _hist_weights()).sum())
+	score += (abs(a.size_q[0] - b.size_q[0]) + abs(a.size_q[1] - b.size_q[1])) * 5.0
+	return score
+
+
+def _pad_int_lists(rows: list[list[int]]) -> tuple["Any", "Any"]:
+	import numpy as np
+
+	lens = np.array([len(r) for r in rows], dtype=np.int64)
+	mat = np.zeros((len(rows), int(lens.max()) if len(rows) else 0), dtype=np.int64)
+	for i, r in enumerate(rows):
+		mat[i, : len(r)] = r
+	return mat, lens
+
+
+def stack_descriptors(descs: list[SymbolDescriptor]) -> dict[str, Any]:
+	"""把一组描述子堆成定长矩阵（变长列表补零并记录长度），供 descriptor_distance_batch 使用。"""
+	import numpy as np
+
+	out: dict[str, Any] = {
+		"counts": np.array([d.counts_np for d in descs], dtype=np.int64).reshape(len(descs), len(_DESC_COUNT_KEYS)),
+		"size": np.array([d.size_q for d in descs], dtype=np.int64).reshape(len(descs), 2),
+	}
+	for f in ("lengths_q", "radii_q", "angles_q"):
+		out[f] = _pad_int_lists([getattr(d, f) for d in descs])
+	out["hist"] = np.array([d.hist_np for d in descs], dtype=np.int64).reshape(
+		len(descs), sum(nbins for _, nbins, _, _ in _HIST_SPEC)
+	)
+	return out
+
+
+def descriptor_distance_batch(a: SymbolDescriptor, stacked: dict[str, Any], *, metric: str = "list") -> "Any":
+	"""
+	a 与 stack_descriptors 结果中每个描述子的 descriptor_distance，shape=(L,) float64。
+	各项都是整数（或乘 0.5/2 的精确倍数），累加与逐个调用逐位一致。
+	metric="hist" 时改为 descriptor_distance_hist。
+	"""
+	import numpy as np
+
+	score = np.abs(stacked["counts"] - a.counts_np).sum(axis=1) * 50.0
+	if metric == "hist":
+		score = score + (np.abs(stacked["hist"] - a.hist_np) * _hist_weights()).sum(axis=1)
+		size = np.asarray(a.size_q, dtype=np.int64)
+		return score + np.abs(stacked["size"] - size).sum(axis=1) * 5.0
+	if metric != "list":
+		raise ValueError(f"unknown descriptor metric: {metric}")
+
+	def list_dist(x: list[int], mat: "Any", lens: "Any", w: float) -> "Any":
+		m = len(x)
+		if m == 0:
+			return np.where(lens == 0, 0.0, w * 200.0 + lens * (w * 10.0))
+		k = min(m, mat.shape[1])
+		xv = np.asarray(x[:k], dtype=np.int64)
+		diff = np.abs(mat[:, :k] - xv)
+		# 只累加两者都有的前 min(len(x), len(y)) 项
+		diff[np.arange(k)[None, :] >= lens[:, None]] = 0
+		d = diff.sum(axis=1) + np.abs(m - lens) * 20
+		return np.where(lens == 0, w * 200.0 + m * (w * 10.0), d * w)
+
+	score = score + list_dist(a.lengths_q, *stacked["lengths_q"], 1.0)
+	score = score + list_dist(a.radii_q, *stacked["radii_q"], 2.0)
+	score = score + list_dist(a.angles_q, *stacked["angles_q"], 0.5)
+	size = np.asarray(a.size_q, dtype=np.int64)
+	score = score + np.abs(stacked["size"] - size).sum(axis=1) * 5.0
+	return score
+
+
+def dumps_json(data: Any) -> str:
+	"""紧凑 JSON 字符串（UTF-8，不转义中文）；有 orjson 时用其加速。"""
+	if orjson is not None:
+		return orjson.dumps(data, option=_ORJSON_OPTS).decode("utf-8")
+	return json.dumps(data, ensure_ascii=False)
+
+
 def load_index(path: str | Path) -> dict[str, Any]:
+	if orjson is not None:
+		with open(path, "rb") as f:
+			return orjson.loads(f.read())
 	with open(path, "r", encoding="utf-8") as f:
 		return json.load(f)
 
 
 def save_index(path: str | Path, data: dict[str, Any]) -> None:
+	if orjson is not None:
+		with open(path, "wb") as f:
+			f.write(orjson.dumps(data, option=_ORJSON_OPTS | orjson.OPT_INDENT_2))
+		return
 	with open(path, "w", encoding="utf-8") as f:
 		json.dump(data, f, ensure_ascii=False, indent=2)
 
 
+# max_points 不超过该值时下采样改用最远点采样（FPS）：点数预算小时等步长抽样容易集中在同一段上，
+# FPS 分布更均匀；更大的预算仍用等步长抽样（O(N)，且保持已有库点云不变）
+_FPS_MAX_POINTS = 300
+
+
+def _fps_kernel(points, k):
+	"""最远点采样的下标：从第 0 点出发，每次取到已选点集最近（平方）距离最大的点，并列取下标小者。O(k·N)。"""
+	n = points.shape[0]
+	idx = np.empty(k, dtype=np.int64)
+	d2 = np.full(n, np.inf)
+	cur = 0
+	for i in range(k):
+		idx[i] = cur
+		cx = points[cur, 0]
+		cy = points[cur, 1]
+		best = 0
+		best_d = -1.0
+		for j in range(n):
+			dx = points[j, 0] - cx
+			dy = points[j, 1] - cy
+			dd = dx * dx + dy * dy
+			if dd < d2[j]:
+				d2[j] = dd
+			if d2[j] > best_d:
+				best_d = d2[j]
+				best = j
+		cur = best
+	return idx
+
+
+if njit is not None:
+	_fps_kernel = njit(cache=True)(_fps_kernel)
+
+
+def _fps_numpy(points, k):
+	"""_fps_kernel 的 numpy 版本（无 numba 时使用），每轮一次向量化更新，结果相同。"""
+	import numpy as np
+
+	idx = np.empty(k, dtype=np.int64)
+	d2 = np.full(len(points), np.inf)
+	cur = 0
+	for i in range(k):
+		idx[i] = cur
+		dx = points[:, 0] - points[cur, 0]
+		dy = points[:, 1] - points[cur, 1]
+		np.minimum(d2, dx * dx + dy * dy, out=d2)
+		cur = int(np.argmax(d2))
+	return idx
+
+
+def _fps_downsample(points, k: int):
+	"""最远点采样 k 个点，按原采样顺序返回。"""
+	import numpy as np
+
+	p = np.ascontiguousarray(points, dtype=np.float64)
+	idx = _fps_kernel(p, int(k)) if njit is not None else _fps_numpy(p, int(k))
+	return p[np.sort(idx)]
+
+
 def _downsample_points(points, max_points: int):
-	# 避免点云过大导致匹配过慢；使用等步长抽样保证确定性
+	# 避免点云过大导致匹配过慢；等步长抽样 / 最远点采样都是确定性的
 	if max_points <= 0:
 		return points
 	try:
@@ -292,6 +675,8 @@ def _downsample_points(points, max_points: int):
 		return points
 	if n <= max_points:
 		return points
+	if max_points <= _FPS_MAX_POINTS:
+		return _fps_downsample(points, max_points)
 	step = max(1, n // max_points)
 	return points[::step]
 
@@ -311,87 +696,228 @@ def sample_points_from_entities(
 - 仅覆盖常见图例实体类型：LINE/CIRCLE/ARC/LWPOLYLINE/POLYLINE/POINT
 - 返回 numpy.ndarray shape=(N,2)
 """
-	import numpy as np
+	return sample_points_from_geometry(
+		[entity_geometry(e) for e in entities],
+		step=step,
+		min_circle_points=min_circle_points,
+		max_points=max_points,
+	)
 
-	points: list[tuple[float, float]] = []
 
-	def add_line(x0: float, y0: float, x1: float, y1: float) -> None:
-		dx = x1 - x0
-		dy = y1 - y0
-		ln = math.hypot(dx, dy)
-		if not math.isfinite(ln) or ln <= 1e-9:
-			points.append((x0, y0))
-			return
-		n = max(2, int(math.ceil(ln / step)) + 1)
-		for i in range(n):
-			t = i / (n - 1)
-			points.append((x0 + dx * t, y0 + dy * t))
+# 采样内核的图元编码：params 每行 (x0, y0, x1, y1, _) / (cx, cy, r, _, _) / (cx, cy, r, start_deg, end_deg) / (x, y, ...)
+_OP_LINE = 0
+_OP_CIRCLE = 1
+_OP_ARC = 2
+_OP_POINT = 3
 
-	for e in entities:
-		t = e.dxftype()
-		try:
-			if t == "LINE":
-				s = e.dxf.start
-				en = e.dxf.end
-				add_line(float(s.x), float(s.y), float(en.x), float(en.y))
-			elif t == "CIRCLE":
-				c = e.dxf.center
-				r = float(e.dxf.radius)
-				if not math.isfinite(r) or r <= 0:
-					continue
-				perimeter = 2.0 * math.pi * r
-				n = max(min_circle_points, int(math.ceil(perimeter / step)))
-				n = min(n, max_points)
-				for i in range(n):
-					ang = 2.0 * math.pi * (i / n)
-					points.append((float(c.x) + r * math.cos(ang), float(c.y) + r * math.sin(ang)))
-			elif t == "ARC":
-				c = e.dxf.center
-				r = float(e.dxf.radius)
-				if not math.isfinite(r) or r <= 0:
-					continue
-				start = math.radians(float(e.dxf.start_angle))
-				end = math.radians(float(e.dxf.end_angle))
-				# 处理跨越 0 的情况
-				if end < start:
-					end += 2.0 * math.pi
-				arc_len = r * (end - start)
-				n = max(min_circle_points, int(math.ceil(arc_len / step)) + 1)
-				n = min(n, max_points)
+
+def _sample_op_count(kind, p, step, min_circle_points, max_points):
+	"""单个图元的采样点数；0 表示跳过。与 sample_points_from_geometry 的 Python 路径逐项一致。"""
+	if kind == _OP_LINE:
+		ln = math.hypot(p[2] - p[0], p[3] - p[1])
+		if not math.isfinite(ln) or ln <= 1e-9:
+			return 1
+		return max(2, int(math.ceil(ln / step)) + 1)
+	if kind == _OP_CIRCLE:
+		r = p[2]
+		if not math.isfinite(r) or r <= 0:
+			return 0
+		n = max(min_circle_points, int(math.ceil(2.0 * math.pi * r / step)))
+		return min(n, max_points)
+	if kind == _OP_ARC:
+		r = p[2]
+		if not math.isfinite(r) or r <= 0:
+			return 0
+		start = math.radians(p[3])
+		end = math.radians(p[4])
+		if end < start:
+			end += 2.0 * math.pi
+		n = max(min_circle_points, int(math.ceil(r * (end - start) / step)) + 1)
+		n = min(n, max_points)
+		return n if n >= 2 else 0
+	return 1
+
+
+def _sample_kernel(kinds, params, step, min_circle_points, max_points):
+	"""两遍：先数点再一次分配 (N,2) 缓冲区逐图元填充，不产生 Python 元组。"""
+	n_ops = kinds.shape[0]
+	counts = np.empty(n_ops, dtype=np.int64)
+	total = 0
+	for k in range(n_ops):
+		counts[k] = _sample_op_count(kinds[k], params[k], step, min_circle_points, max_points)
+		total += counts[k]
+	out = np.empty((total, 2), dtype=np.float64)
+	off = 0
+	for k in range(n_ops):
+		n = counts[k]
+		if n == 0:
+			continue
+		kind = kinds[k]
+		p = params[k]
+		if kind == _OP_LINE:
+			x0 = p[0]
+			y0 = p[1]
+			if n == 1:
+				out[off, 0] = x0
+				out[off, 1] = y0
+			else:
+				dx = p[2] - x0
+				dy = p[3] - y0
 				for i in range(n):
-					ang = start + (end - start) * (i / (n - 1))
-					points.append((float(c.x) + r * math.cos(ang), float(c.y) + r * math.sin(ang)))
-			elif t == "LWPOLYLINE":
-				pts = list(e.get_points("xy"))
-				if len(pts) < 2:
-					continue
-				for (x0, y0), (x1, y1) in zip(pts, pts[1:]):
-					add_line(float(x0), float(y0), float(x1), float(y1))
-				if bool(getattr(e, "closed", False)):
-					x0, y0 = pts[-1]
-					x1, y1 = pts[0]
-					add_line(float(x0), float(y0), float(x1), float(y1))
-			elif t == "POLYLINE":
-				vs = [v.dxf.location for v in e.vertices]  # type: ignore[attr-defined]
-				if len(vs) < 2:
-					continue
-				pts = [(float(p.x), float(p.y)) for p in vs]
-				for (x0, y0), (x1, y1) in zip(pts, pts[1:]):
-					add_line(x0, y0, x1, y1)
-				if bool(getattr(e, "is_closed", False)):
-					add_line(pts[-1][0], pts[-1][1], pts[0][0], pts[0][1])
-			elif t == "POINT":
-				p = e.dxf.location
-				points.append((float(p.x), float(p.y)))
-		except Exception:
+					t = i / (n - 1)
+					out[off + i, 0] = x0 + dx * t
+					out[off + i, 1] = y0 + dy * t
+		elif kind == _OP_CIRCLE:
+			cx = p[0]
+			cy = p[1]
+			r = p[2]
+			for i in range(n):
+				ang = 2.0 * math.pi * (i / n)
+				out[off + i, 0] = cx + r * math.cos(ang)
+				out[off + i, 1] = cy + r * math.sin(ang)
+		elif kind == _OP_ARC:
+			cx = p[0]
+			cy = p[1]
+			r = p[2]
+			start = math.radians(p[3])
+			end = math.radians(p[4])
+			if end < start:
+				end += 2.0 * math.pi
+			for i in range(n):
+				ang = start + (end - start) * (i / (n - 1))
+				out[off + i, 0] = cx + r * math.cos(ang)
+				out[off + i, 1] = cy + r * math.sin(ang)
+		else:
+			out[off, 0] = p[0]
+			out[off, 1] = p[1]
+		off += n
+	return out
+
+
+if njit is not None:
+	_sample_op_count = njit(cache=True)(_sample_op_count)
+	_sample_kernel = njit(cache=True)(_sample_kernel)
+
+
+def _sample_numpy(kinds, params, step, min_circle_points, max_points):
+	"""
+	_sample_kernel 的纯 numpy 版本（无 numba 时使用）：按图元类型整体算点数，
+	一次分配 (N,2) 缓冲区，再用 np.repeat 展开的 (图元, 序号) 直接写入各自位置。
+	"""
+	import numpy as np
+
+	p = params
+	counts = np.zeros(len(kinds), dtype=np.int64)
+	with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+		m = kinds == _OP_LINE
+		ln = np.hypot(p[m, 2] - p[m, 0], p[m, 3] - p[m, 1])
+		ok = np.isfinite(ln) & (ln > 1e-9)
+		counts[m] = np.where(ok, np.maximum(2, np.ceil(np.where(ok, ln, 0.0) / step) + 1), 1)
+
+		m = kinds == _OP_CIRCLE
+		r = p[m, 2]
+		ok = np.isfinite(r) & (r > 0)
+		n = np.maximum(min_circle_points, np.ceil(2.0 * math.pi * np.where(ok, r, 0.0) / step))
+		counts[m] = np.where(ok, np.minimum(n, max_points), 0)
+
+		m = kinds == _OP_ARC
+		r = p[m, 2]
+		start = np.radians(p[m, 3])
+		end = np.radians(p[m, 4])
+		end = np.where(end < start, end + 2.0 * math.pi, end)
+		ok = np.isfinite(r) & (r > 0)
+		n = np.maximum(min_circle_points, np.ceil(np.where(ok, r, 0.0) * (end - start) / step) + 1)
+		n = np.minimum(n, max_points)
+		counts[m] = np.where(ok & (n >= 2), n, 0)
+
+		counts[kinds == _OP_POINT] = 1
+
+	offsets = np.cumsum(counts) - counts
+	out = np.empty((int(counts.sum()), 2), dtype=np.float64)
+
+	def expand(kind):
+		idx = np.flatnonzero((kinds == kind) & (counts > 0))
+		cnt = counts[idx]
+		rep = np.repeat(idx, cnt)
+		i = np.arange(len(rep), dtype=np.int64) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+		return rep, i, counts[rep], offsets[rep] + i
+
+	rep, i, n, pos = expand(_OP_LINE)
+	x0 = p[rep, 0]
+	y0 = p[rep, 1]
+	t = i / np.maximum(n - 1, 1)
+	single = n == 1
+	out[pos, 0] = np.where(single, x0, x0 + (p[rep, 2] - x0) * t)
+	out[pos, 1] = np.where(single, y0, y0 + (p[rep, 3] - y0) * t)
+
+	rep, i, n, pos = expand(_OP_CIRCLE)
+	ang = 2.0 * math.pi * (i / n)
+	out[pos, 0] = p[rep, 0] + p[rep, 2] * np.cos(ang)
+	out[pos, 1] = p[rep, 1] + p[rep, 2] * np.sin(ang)
+
+	rep, i, n, pos = expand(_OP_ARC)
+	start = np.radians(p[rep, 3])
+	end = np.radians(p[rep, 4])
+	end = np.where(end < start, end + 2.0 * math.pi, end)
+	ang = start + (end - start) * (i / (n - 1))
+	out[pos, 0] = p[rep, 0] + p[rep, 2] * np.cos(ang)
+	out[pos, 1] = p[rep, 1] + p[rep, 2] * np.sin(ang)
+
+	pos = offsets[kinds == _OP_POINT]
+	out[pos] = p[kinds == _OP_POINT, 0:2]
+	return out
+
+
+def _geometry_ops(geoms: list[tuple[str, Any]]) -> tuple[list[int], list[tuple[float, ...]]]:
+	"""把 entity_geometry 结果按原顺序拆成采样图元（多段线拆成线段，闭合时补首尾段）。"""
+	kinds: list[int] = []
+	params: list[tuple[float, ...]] = []
+	for t, g in geoms:
+		if g is None:
 			continue
+		if t == "LINE":
+			kinds.append(_OP_LINE)
+			params.append((*g, 0.0))
+		elif t == "CIRCLE":
+			kinds.append(_OP_CIRCLE)
+			params.append((*g, 0.0, 0.0))
+		elif t == "ARC":
+			kinds.append(_OP_ARC)
+			params.append(g)
+		elif t in ("LWPOLYLINE", "POLYLINE"):
+			pts, is_closed = g
+			if len(pts) < 2:
+				continue
+			seq = pts + [pts[0]] if is_closed else pts
+			for (x0, y0), (x1, y1) in zip(seq, seq[1:]):
+				kinds.append(_OP_LINE)
+				params.append((x0, y0, x1, y1, 0.0))
+		elif t == "POINT":
+			kinds.append(_OP_POINT)
+			params.append((*g, 0.0, 0.0, 0.0))
+	return kinds, params
 
-	if not points:
-		return np.zeros((0, 2), dtype=float)
 
-	arr = np.asarray(points, dtype=float)
-	arr = _downsample_points(arr, max_points)
-	return np.asarray(arr, dtype=float)
+def sample_points_from_geometry(
+	geoms: list[tuple[str, Any]],
+	*,
+	step: float,
+	min_circle_points: int = 16,
+	max_points: int = 600,
+) -> "Any":
+	"""sample_points_from_entities 的几何版本，输入为 entity_geometry 的结果。"""
+	import numpy as np
+
+	kinds, params = _geometry_ops(geoms)
+	if not kinds:
+		return np.zeros((0, 2), dtype=float)
+	kinds_a = np.asarray(kinds, dtype=np.int64)
+	params_a = np.asarray(params, dtype=np.float64).reshape(len(kinds), 5)
+	if njit is not None:
+		arr = _sample_kernel(kinds_a, params_a, float(step), int(min_circle_points), int(max_points))
+	else:
+		arr = _sample_numpy(kinds_a, params_a, float(step), int(min_circle_points), int(max_points))
+	return np.asarray(_downsample_points(arr, max_points), dtype=float)
 
 
 def normalize_points(points: "Any", bbox: tuple[float, float, float, float]) -> "Any":
@@ -416,20 +942,61 @@ def normalize_points(points: "Any", bbox: tuple[float, float, float, float]) ->
 	return p
 
 
-def rotate_points(points: "Any", angle_deg: float) -> "Any":
+def rotation_matrices(angles_deg: Iterable[float]) -> "Any":
+	"""一组角度（度）的 2x2 旋转矩阵，shape=(K,2,2)；sin/cos 一次向量化算出。"""
+	import numpy as np
+
+	rad = np.radians(np.asarray(list(angles_deg), dtype=float))
+	c = np.cos(rad)
+	s = np.sin(rad)
+	return np.stack([np.stack([c, -s], axis=-1), np.stack([s, c], axis=-1)], axis=-2)
+
+
+def rotate_points(points: "Any", angle_deg: float, *, out: "Any" = None) -> "Any":
+	"""
+	点云绕原点旋转 angle_deg 度。float64 输入不复制；给出 out（同形状 float64 数组）时结果直接写入 out，
+	多角度循环可复用同一块缓冲区，每个角度零分配。
+	"""
 	import numpy as np
 
 	if len(points) == 0:
-		return points
-	rad = math.radians(angle_deg)
-	c = math.cos(rad)
-	s = math.sin(rad)
-	R = np.array([[c, -s], [s, c]], dtype=float)
-	return np.asarray(points, dtype=float) @ R.T
+		return points if out is None else out
+	R = rotation_matrices((angle_deg,))[0]
+	return np.matmul(np.asarray(points, dtype=float), R.T, out=out)
+
+
+# 8 * 16383^2 < 2^31：坐标差的平方和在 int32 内不会溢出
+_NN_QUANT_SCALE = 16383
+
+
+def quantize_points_i16(points: "Any") -> "Any":
+	"""归一化点云（|坐标| <= 1）量化为 int16，比例 _NN_QUANT_SCALE。"""
+	import numpy as np
 
+	p = np.clip(np.asarray(points, dtype=float), -1.0, 1.0)
+	return np.rint(p * _NN_QUANT_SCALE).astype(np.int16)
 
-def _mean_nn_distance(a: "Any", b: "Any") -> float:
-	"""a->b 的平均最近邻距离。优先使用 scipy.cKDTree，否则回退到 numpy 暴力法（带分块）。"""
+
+def _min_sq_dist_int(qa: "Any", qb: "Any") -> "Any":
+	"""int16 点云 qa 每点到 qb 的最近平方距离（暴力法，按 512 行分块），在 int32 上计算。"""
+	import numpy as np
+
+	qb = qb.astype(np.int32)
+	min_q2 = []
+	for i in range(0, len(qa), 512):
+		aa = qa[i : i + 512].astype(np.int32)
+		dx = aa[:, None, 0] - qb[None, :, 0]
+		dy = aa[:, None, 1] - qb[None, :, 1]
+		min_q2.append((dx * dx + dy * dy).min(axis=1))
+	return np.concatenate(min_q2, axis=0)
+
+
+def _mean_nn_distance(a: "Any", b: "Any", *, max_mean: float = math.inf, workers: int = 1) -> float:
+	"""
+	a->b 的平均最近邻距离。优先使用 scipy.cKDTree，否则回退到 numpy 暴力法（带分块，归一化点云走 int16 量化）。
+	max_mean：调用方只关心不超过它的结果。单点距离超过 max_mean*len(a) 时均值必然超过 max_mean，
+	据此给 KD 树传 distance_upper_bound 剪枝，超界直接返回 inf。workers 透传给 cKDTree.query。
+	"""
 	import numpy as np
 
 	a = np.asarray(a, dtype=float)
@@ -437,101 +1004,416 @@ def _mean_nn_distance(a: "Any", b: "Any") -> float:
 	if len(a) == 0 or len(b) == 0:
 		return float("inf")
 
-	try:
-		from scipy.spatial import cKDTree  # type: ignore[import-not-found]
-
-		tree = cKDTree(b)
-		dists, _ = tree.query(a, k=1)
+	cKDTree = _ckdtree()
+	if cKDTree is not None:
+		# distance_upper_bound 不含边界本身且内部按平方比较：放宽一点，过小的界（平方下溢）不用
+		bound = max_mean * len(a) * (1.0 + 1e-12)
+		if not bound > 1e-100:
+			bound = math.inf
+		dists, _ = cKDTree(b).query(a, k=1, distance_upper_bound=bound, workers=workers)
+		if math.isfinite(bound) and not np.isfinite(dists).all():
+			return float("inf")
 		return float(np.mean(dists))
-	except Exception:
-		# numpy 暴力法：分块避免大矩阵
-		chunk = 512
-		min_d2 = []
-		for i in range(0, len(a), chunk):
-			aa = a[i : i + chunk]
-			# (na,1,2) - (1,nb,2) => (na,nb,2)
-			diff = aa[:, None, :] - b[None, :, :]
-			d2 = np.sum(diff * diff, axis=2)
-			min_d2.append(np.min(d2, axis=1))
-		d2_all = np.concatenate(min_d2, axis=0)
-		return float(np.mean(np.sqrt(d2_all)))
-
-
-def chamfer_distance(points_a: "Any", points_b: "Any", *, symmetric: bool = True) -> float:
-	"""Chamfer 距离：平均最近邻距离（可选对称）。"""
-	d1 = _mean_nn_distance(points_a, points_b)
+
+	# numpy 暴力法：分块避免大矩阵
+	if max(np.abs(a).max(), np.abs(b).max()) <= 1.0:
+		# 归一化点云（|坐标| <= 1）量化到 int16 网格，在 int32 上算平方距离：
+		# 内存带宽减半；量化误差每坐标 <= 0.5/_NN_QUANT_SCALE，远小于匹配阈值
+		q2_all = _min_sq_dist_int(quantize_points_i16(a), quantize_points_i16(b))
+		return float(np.mean(np.sqrt(q2_all))) / _NN_QUANT_SCALE
+
+	# 其余情况用二次型 |a|^2 + |b|^2 - 2 a·b^T：交叉项走 BLAS 矩阵乘，不再构造 (na,nb,2) 差值张量；
+	# 点数很多时按行分块限制内存
+	bb2 = (b * b).sum(axis=1)
+	chunk = 2048
+	min_d2 = []
+	for i in range(0, len(a), chunk):
+		aa = a[i : i + chunk]
+		d2 = (aa * aa).sum(axis=1)[:, None] + bb2[None, :] - 2.0 * (aa @ b.T)
+		min_d2.append(d2.min(axis=1))
+	d2_all = np.maximum(np.concatenate(min_d2, axis=0), 0.0)
+	return float(np.mean(np.sqrt(d2_all)))
+
+
+def chamfer_distance(
+	points_a: "Any",
+	points_b: "Any",
+	*,
+	symmetric: bool = True,
+	max_score: float = math.inf,
+	workers: int = 1,
+) -> float:
+	"""
+	Chamfer 距离：平均最近邻距离（可选对称）。
+	给定 max_score 时，能确定结果超过它就提前返回 inf（单向距离已超界则不再算反方向）。
+	"""
+	d1 = _mean_nn_distance(points_a, points_b, max_mean=max_score * (2.0 if symmetric else 1.0), workers=workers)
 	if not symmetric:
 		return d1
-	d2 = _mean_nn_distance(points_b, points_a)
+	if 0.5 * d1 > max_score:
+		return float("inf")
+	d2 = _mean_nn_distance(points_b, points_a, max_mean=2.0 * max_score - d1, workers=workers)
 	return 0.5 * (d1 + d2)
 
 
+def canonical_orient(points: "Any", *, max_ratio: float = 0.8) -> Optional[float]:
+	"""
+	点云主方向（度）：2x2 协方差最大特征值对应的特征向量方向，仅确定到 ±180°。
+	两个特征值接近（小/大 > max_ratio，如圆、正方形）时主方向不可靠，返回 None。
+	"""
+	import numpy as np
+
+	p = np.asarray(points, dtype=float)
+	if len(p) < 2:
+		return None
+	w, v = np.linalg.eigh(np.cov(p.T))
+	if not w[1] > 0 or w[0] / w[1] > max_ratio:
+		return None
+	return math.degrees(math.atan2(v[1, 1], v[0, 1]))
+
+
+def canonical_angle_subset(template_points: "Any", candidate_points: "Any", angles: list[float]) -> list[int]:
+	"""
+	主方向对齐：两者主方向之差（及其 +180°，主方向有符号歧义）各取最接近的候选角，
+	返回需要尝试的 angles 下标（升序）；任一主方向不可靠时返回全部下标。
+	"""
+	ta = canonical_orient(template_points)
+	ca = canonical_orient(candidate_points)
+	if ta is None or ca is None or len(angles) <= 2:
+		return list(range(len(angles)))
+	d = ca - ta
+
+	def nearest(target: float) -> int:
+		return min(range(len(angles)), key=lambda k: abs((angles[k] - target + 180.0) % 360.0 - 180.0))
+
+	return sorted({nearest(d), nearest(d + 180.0)})
+
+
 def chamfer_best_rotation(
 	template_points: "Any",
 	candidate_points: "Any",
 	*,
 	angles_deg: Iterable[float] = (0, 90, 180, 270),
 	symmetric: bool = True,
+	use_canonical: bool = False,
 ) -> tuple[float, float]:
-	"""尝试多个旋转角，返回 (best_score, best_angle_deg)。"""
+	"""
+	尝试多个旋转角，返回 (best_score, best_angle_deg)。
+	有 scipy 时交给 chamfer_best_rotation_many：候选树和模板树各建一次，所有角度共用。
+	use_canonical=True 时先按主方向对齐，只尝试 canonical_angle_subset 选出的（通常 2 个）角度。
+	"""
+	import numpy as np
+
+	if len(template_points) and len(candidate_points) and _ckdtree() is not None:
+		return chamfer_best_rotation_many(
+			[template_points],
+			candidate_points,
+			angles_deg=angles_deg,
+			symmetric=symmetric,
+			use_canonical=use_canonical,
+		)[0]
+	angles = [float(a) for a in angles_deg]
+	if use_canonical and len(template_points) and len(candidate_points):
+		angles = [angles[k] for k in canonical_angle_subset(template_points, candidate_points, angles)]
 	best_score = float("inf")
 	best_angle = 0.0
-	for ang in angles_deg:
-		rot = rotate_points(template_points, float(ang))
-		s = chamfer_distance(rot, candidate_points, symmetric=symmetric)
+	if not len(template_points) or not angles:
+		return best_score, best_angle
+	# 旋转结果写进同一块预分配缓冲区，各角度之间不再分配新数组
+	tpl = np.ascontiguousarray(template_points, dtype=float)
+	cand = np.asarray(candidate_points, dtype=float)
+	rot = np.empty_like(tpl)
+	for ang in angles:
+		rotate_points(tpl, ang, out=rot)
+		s = chamfer_distance(rot, cand, symmetric=symmetric, max_score=best_score)
 		if s < best_score:
 			best_score = s
 			best_angle = float(ang)
 	return best_score, best_angle
 
 
-def flatten_entities(entities: Iterable, doc: ezdxf.EzdxfDocument, *, max_depth: int = 2) -> list:
-	"""尽量展开 INSERT，生成可用于 bbox/采样/匹配的“平铺实体”列表。"""
-	from ezdxf.math import Matrix44
+def radial_profile(points: "Any") -> "Any":
+	"""点到原点距离的升序数组；绕原点旋转不变，用于 chamfer_lower_bound。"""
+	import numpy as np
+
+	p = np.asarray(points, dtype=float)
+	if len(p) == 0:
+		return np.zeros(0, dtype=float)
+	return np.sort(np.hypot(p[:, 0], p[:, 1]))
+
+
+def _radial_nn_mean(ra: "Any", rb: "Any") -> float:
+	import numpy as np
+
+	pos = np.searchsorted(rb, ra)
+	lo = rb[np.clip(pos - 1, 0, len(rb) - 1)]
+	hi = rb[np.clip(pos, 0, len(rb) - 1)]
+	return float(np.mean(np.minimum(np.abs(ra - lo), np.abs(hi - ra))))
+
+
+def chamfer_lower_bound(radii_a: "Any", radii_b: "Any", *, symmetric: bool = True) -> float:
+	"""
+	任意旋转角下 chamfer_distance 的下界：由三角不等式 |r(p) - r(q)| <= |p - q|，
+	a 中每点到 b 的最近距离不小于半径上的一维最近距离。输入为 radial_profile 的结果。
+	"""
+	if len(radii_a) == 0 or len(radii_b) == 0:
+		return float("inf")
+	d1 = _radial_nn_mean(radii_a, radii_b)
+	if not symmetric:
+		return d1
+	return 0.5 * (d1 + _radial_nn_mean(radii_b, radii_a))
+
+
+def chamfer_error_bound() -> float:
+	"""
+	当前环境下 chamfer_distance 相对精确值的最大误差：有 scipy 时为 0；
+	无 scipy 时归一化点云走 int16 量化，两端点各偏移不超过 sqrt(2)/2 个量化步长，单点距离误差 <= sqrt(2)/_NN_QUANT_SCALE，
+	取均值（及对称平均）后仍不超过它。用下界剪枝的调用方需把它加到比较阈值上。
+	"""
+	if _ckdtree() is not None:
+		return 0.0
+	return math.sqrt(2.0) / _NN_QUANT_SCALE
+
+
+def _ckdtree() -> "Any":
+	"""scipy.spatial.cKDTree；无 scipy 时返回 None。"""
+	try:
+		from scipy.spatial import cKDTree  # type: ignore[import-not-found]
+	except Exception:
+		return None
+	return cKDTree
+
+
+def point_tree(points: "Any") -> "Any":
+	"""点云的 cKDTree（leafsize=32）；无 scipy 或点云为空时返回 None。模板点云固定不变，树可以建一次反复查询。"""
+	import numpy as np
+
+	cKDTree = _ckdtree()
+	if cKDTree is None:
+		return None
+	p = np.asarray(points, dtype=float)
+	if len(p) == 0:
+		return None
+	return cKDTree(p, leafsize=32)
+
+
+def _mean_nn_distance_bounded(a: "Any", tree_b: "Any", bound_sum: float, *, block: int = 64) -> float:
+	"""
+	a 到 tree_b（cKDTree）的平均最近邻距离，分块查询：已累加的距离和超过 bound_sum 就返回 inf。
+	块大小从 block 起逐块翻倍，查询次数 O(log n)；未提前退出时结果与一次性查询的均值逐位一致。
+	"""
+	import numpy as np
+
+	if not bound_sum < math.inf:
+		d, _ = tree_b.query(a, k=1)
+		return float(np.mean(d))
+	# 分块累加与整体求和的舍入不同：放宽一点，避免把恰好并列最优的角度误判为超界
+	bound = bound_sum * (1.0 + 1e-12)
+	parts = []
+	total = 0.0
+	i = 0
+	step = block
+	while i < len(a):
+		d, _ = tree_b.query(a[i : i + step], k=1)
+		parts.append(d)
+		total += float(d.sum())
+		if total > bound:
+			return float("inf")
+		i += step
+		step *= 2
+	return float(np.mean(np.concatenate(parts)))
+
+
+def chamfer_best_rotation_many(
+	templates: list,
+	candidate_points: "Any",
+	*,
+	angles_deg: Iterable[float] = (0, 90, 180, 270),
+	symmetric: bool = True,
+	template_trees: Optional[list] = None,
+	cand_tree: "Any" = None,
+	use_canonical: bool = False,
+) -> list[tuple[float, float]]:
+	"""
+	对同一候选点云批量计算多个模板的 chamfer_best_rotation，结果与逐个调用一致（差别仅在浮点舍入）。
+	有 scipy 时：候选点云只建一棵树（cand_tree，可由调用方按簇缓存），旋转后的模板去查它；
+	反方向利用旋转保距，把候选点云反向旋转后去查模板自身的树（template_trees，可预先缓存），
+	每个角度都不再建树。use_canonical 同 chamfer_best_rotation。
+	"""
+	import numpy as np
+
+	angles = [float(a) for a in angles_deg]
+	cand = np.asarray(candidate_points, dtype=float)
+	tpls = [np.asarray(t, dtype=float) for t in templates]
+	if cand_tree is None:
+		cand_tree = point_tree(cand)
+	if cand_tree is None or not any(len(t) for t in tpls):
+		return [
+			chamfer_best_rotation(t, cand, angles_deg=angles, symmetric=symmetric, use_canonical=use_canonical)
+			for t in tpls
+		]
+
+	trees = list(template_trees) if template_trees is not None else [None] * len(tpls)
+	if symmetric:
+		trees = [tr if tr is not None else point_tree(t) for t, tr in zip(tpls, trees)]
+
+	best = [(float("inf"), 0.0) for _ in tpls]
+	if not angles:
+		return best
+	# 全部角度一次旋转成 (K,N,2)，每个模板每个方向只查一次树，再按角度 reshape 求均值
+	mats = rotation_matrices(angles)
+	# cand @ R 即把候选点云旋转 -ang
+	cand_back = np.einsum("nj,kji->kni", cand, mats) if symmetric else None
+	for k, t in enumerate(tpls):
+		if not len(t):
+			continue
+		sel = canonical_angle_subset(t, cand, angles) if use_canonical else list(range(len(angles)))
+		n_ang = len(sel)
+		d_tc, _ = cand_tree.query(np.einsum("kij,nj->kni", mats[sel], t).reshape(-1, 2), k=1)
+		scores = d_tc.reshape(n_ang, -1).mean(axis=1)
+		if symmetric:
+			# 反方向按 t->c 均值从小到大逐个角度算，0.5*(tc+ct) 超过当前最优即可放弃：
+			# 预算 (2*best - tc)*len(cand) 交给分块查询提前退出；tc 本身已超界的角度（及其后所有角度）直接跳过。
+			# 被放弃的角度得分必然大于最优，argmin（并列取靠前角度）结果不变
+			tc = scores
+			scores = np.full(n_ang, np.inf)
+			best_s = math.inf
+			for j in np.argsort(tc, kind="stable").tolist():
+				if 0.5 * tc[j] > best_s:
+					break
+				ct = _mean_nn_distance_bounded(cand_back[sel[j]], trees[k], (2.0 * best_s - tc[j]) * len(cand))
+				if ct == math.inf:
+					continue
+				scores[j] = 0.5 * (tc[j] + ct)
+				best_s = min(best_s, scores[j])
+		a = int(np.argmin(scores))
+		if scores[a] < best[k][0]:
+			best[k] = (float(scores[a]), angles[sel[a]])
+	return best
 
-	identity = Matrix44()
 
-	def transform_clone(entity, m: Matrix44):
+def match_batch(
+	template_points: "Any",
+	candidates: list,
+	*,
+	angles_deg: Iterable[float] = (0, 90, 180, 270),
+	symmetric: bool = True,
+	use_canonical: bool = False,
+	template_tree: "Any" = None,
+	n_jobs: int = -1,
+) -> list[tuple[float, float]]:
+	"""
+	一个模板对多个候选点云的 chamfer_best_rotation，结果顺序与 candidates 一致。
+	模板树只建一次（也可由调用方传入缓存的 template_tree）、各候选共用（cKDTree 查询只读，可跨线程共享）；n_jobs != 1 时用线程池并行，
+	-1 表示 os.cpu_count()。cKDTree.query 与 numpy 运算会释放 GIL，所以线程即可并行；
+	内层查询保持单线程，避免与外层线程池叠加导致超订。候选很少或点云很小时线程调度开销可能抵消收益，
+	此时用 n_jobs=1。无 scipy 时逐个退回 chamfer_best_rotation。
+	"""
+	import os
+	from concurrent.futures import ThreadPoolExecutor
+
+	angles = [float(a) for a in angles_deg]
+	tree = template_tree
+	if tree is None and symmetric:
+		tree = point_tree(template_points)
+
+	def one(cand: "Any") -> tuple[float, float]:
+		return chamfer_best_rotation_many(
+			[template_points],
+			cand,
+			angles_deg=angles,
+			symmetric=symmetric,
+			template_trees=[tree],
+			use_canonical=use_canonical,
+		)[0]
+
+	jobs = (os.cpu_count() or 1) if n_jobs < 0 else max(1, n_jobs)
+	jobs = min(jobs, len(candidates))
+	if jobs <= 1:
+		return [one(c) for c in candidates]
+	with ThreadPoolExecutor(max_workers=jobs) as ex:
+		return list(ex.map(one, candidates))
+
+
+def _transform_clone(entity, m: "Any"):
+	"""复制实体并应用变换矩阵；变换失败（如非均匀缩放的圆弧）返回 None。"""
+	e = entity.copy()
+	try:
+		e.transform(m)
+		return e
+	except ZeroDivisionError:
+		# 部分实体的 extrusion 变换会触发除零，尝试降级处理。
+		# 此时坐标可能已被变换过一次（如 LINE 先写端点再处理 thickness），必须在新副本上重试
 		e = entity.copy()
+		try:
+			if e.dxf.hasattr("thickness"):
+				e.dxf.discard("thickness")
+		except Exception:
+			pass
+		try:
+			if e.dxf.hasattr("extrusion"):
+				e.dxf.discard("extrusion")
+		except Exception:
+			pass
 		try:
 			e.transform(m)
 			return e
-		except ZeroDivisionError:
-			# 部分实体的 extrusion 变换会触发除零，尝试降级处理
-			try:
-				if e.dxf.hasattr("thickness"):
-					e.dxf.discard("thickness")
-			except Exception:
-				pass
-			try:
-				if e.dxf.hasattr("extrusion"):
-					e.dxf.discard("extrusion")
-			except Exception:
-				pass
-			try:
-				e.transform(m)
-				return e
-			except Exception:
-				return None
 		except Exception:
 			return None
+	except Exception:
+		return None
+
+
+def flatten_entities(
+	entities: Iterable,
+	doc: ezdxf.EzdxfDocument,
+	*,
+	max_depth: int = 2,
+	clone_entities: bool = True,
+	cache: Optional[dict] = None,
+) -> list:
+	"""
+	尽量展开 INSERT，生成可用于 bbox/采样/匹配的“平铺实体”列表。
+	clone_entities=False 时不复制实体，返回 (原实体, 累积变换矩阵) 列表，未经变换的顶层实体矩阵为 None；
+	几何由 transformed_geometry 直接在坐标上变换得到。
+	cache：可选 dict，同一文档多次调用时传同一个，块的子实体列表与各 INSERT 的 matrix44() 只算一次
+	（按实体对象作键，要求期间文档内容不变）。
+	"""
+	from ezdxf.math import Matrix44
+
+	identity = Matrix44()
+	if cache is None:
+		cache = {}
+	block_children: dict[str, list] = cache.setdefault("block_children", {})
+	insert_mats: dict = cache.setdefault("insert_mats", {})
 
 	def walk(entity, m: Matrix44, depth: int):
 		if entity.dxftype() == "INSERT" and depth < max_depth:
-			try:
-				blk = doc.blocks.get(entity.dxf.name)
-			except Exception:
-				return
-			m2 = m @ entity.matrix44()
-			for child in blk:
+			name = entity.dxf.name
+			children = block_children.get(name)
+			if children is None:
+				try:
+					blk = doc.blocks.get(name)
+				except Exception:
+					return
+				children = block_children[name] = list(blk)
+			em = insert_mats.get(entity)
+			if em is None:
+				em = insert_mats[entity] = entity.matrix44()
+			m2 = m @ em
+			for child in children:
 				yield from walk(child, m2, depth + 1)
 			return
 
+		if not clone_entities:
+			yield entity, (None if m is identity else m)
+			return
+
 		if m is identity:
 			yield entity
 			return
 
-		cl = transform_clone(entity, m)
+		cl = _transform_clone(entity, m)
 		if cl is not None:
 			yield cl
 
@@ -541,6 +1423,60 @@ def flatten_entities(entities: Iterable, doc: ezdxf.EzdxfDocument, *, max_depth:
 	return out
 
 
+def transformed_geometry(entity, m: "Any") -> Optional[tuple[str, Any]]:
+	"""
+	entity_geometry(实体经矩阵 m 变换后)，但不复制实体：LINE/POINT/CIRCLE/ARC/LWPOLYLINE
+	直接按 ezdxf 各自 transform 的同一套公式变换坐标，其余类型或异常情况退回复制+变换。
+	m 为 None 表示不变换。实体无法变换时（复制路径会丢弃它）返回 None。
+	"""
+	if m is None:
+		return entity_geometry(entity)
+	t = entity.dxftype()
+	try:
+		if t == "LINE":
+			s, e = m.transform_vertices([entity.dxf.start, entity.dxf.end])
+			return t, (float(s.x), float(s.y), float(e.x), float(e.y))
+		if t == "POINT":
+			p = m.transform(entity.dxf.location)
+			return t, (float(p.x), float(p.y))
+		if t in ("CIRCLE", "ARC", "LWPOLYLINE"):
+			from ezdxf.math import OCSTransform, arc_angle_span_deg
+
+			ocs = OCSTransform(entity.dxf.extrusion, m)
+			if t == "LWPOLYLINE":
+				if not ocs.scale_uniform and entity.has_arc:
+					return None
+				pts = [[v.x, v.y] for v in map(ocs.transform_vertex, entity.vertices_in_ocs())]
+				return t, (pts, bool(entity.closed))
+			if not ocs.scale_uniform:
+				return None
+			c = ocs.transform_vertex(entity.dxf.center)
+			r = float(ocs.transform_length((entity.dxf.radius, 0, 0)))
+			if t == "CIRCLE":
+				return t, (float(c.x), float(c.y), r)
+			sa = entity.dxf.start_angle
+			ea = entity.dxf.end_angle
+			if not math.isclose(arc_angle_span_deg(sa, ea), 360.0):
+				sa, ea = ocs.transform_ccw_arc_angles_deg(sa, ea)
+			return t, (float(c.x), float(c.y), r, float(sa), float(ea))
+	except Exception:
+		pass
+	cl = _transform_clone(entity, m)
+	return None if cl is None else entity_geometry(cl)
+
+
+def flatten_geometry(
+	entities: Iterable, doc: ezdxf.EzdxfDocument, *, max_depth: int = 2, cache: Optional[dict] = None
+) -> list[tuple[str, Any]]:
+	"""展开 INSERT 并直接给出每个平铺实体的 entity_geometry 结果，块内实体不再逐个复制。cache 同 flatten_entities。"""
+	out = []
+	for e, m in flatten_entities(entities, doc, max_depth=max_depth, clone_entities=False, cache=cache):
+		g = transformed_geometry(e, m)
+		if g is not None:
+			out.append(g)
+	return out
+
+
 def bbox_of_entities(entities: Iterable) -> Optional[tuple[float, float, float, float]]:
 	bbs = []
 	for e in entities:
@@ -551,6 +1487,17 @@ def bbox_of_entities(entities: Iterable) -> Optional[tuple[float, float, float,
 	return merge_bbox(bbs)
 
 
+def bbox_of_geometry(geoms: list[tuple[str, Any]]) -> Optional[tuple[float, float, float, float]]:
+	"""bbox_of_entities 的几何版本，输入为 entity_geometry 的结果。"""
+	bbs = []
+	for t, g in geoms:
+		b = geometry_bbox(t, g)
+		if b is None:
+			continue
+		bbs.append(b)
+	return merge_bbox(bbs)
+
+
 def point_cloud_from_entities(
 	entities: Iterable,
 	bbox: tuple[float, float, float, float],
@@ -559,41 +1506,118 @@ def point_cloud_from_entities(
 	max_points: int = 600,
 ) -> "Any":
 	"""按 bbox 归一化后的点云（用于 Chamfer 距离匹配）。"""
+	return point_cloud_from_geometry(
+		[entity_geometry(e) for e in entities], bbox, sample_div=sample_div, max_points=max_points
+	)
+
+
+def point_cloud_from_geometry(
+	geoms: list[tuple[str, Any]],
+	bbox: tuple[float, float, float, float],
+	*,
+	sample_div: float = 30.0,
+	max_points: int = 600,
+) -> "Any":
+	"""point_cloud_from_entities 的几何版本，输入为 entity_geometry 的结果。"""
 	minx, miny, maxx, maxy = bbox
 	norm = max(maxx - minx, maxy - miny)
 	if not math.isfinite(norm) or norm <= 1e-9:
 		norm = 1.0
 	step = norm / sample_div if sample_div > 0 else norm / 30.0
 	step = max(step, 1e-6)
-	pts = sample_points_from_entities(entities, step=step, max_points=max_points)
+	pts = sample_points_from_geometry(geoms, step=step, max_points=max_points)
 	return normalize_points(pts, bbox)
 
 
-def encode_point_cloud(points: "Any", *, scale: int = 32767) -> dict[str, Any]:
+# 点云 encoding 标签："<codec>-base64-int16[-delta]"；-delta 表示压缩前对 int16 点序列逐行差分
+_POINT_CODECS = ("zlib", "zstd")
+DEFAULT_POINT_ENCODING = "zlib-base64-int16"
+
+
+def point_cloud_encoding(codec: str = "zlib", *, delta: bool = False) -> str:
+	"""由压缩算法与是否差分拼出 encoding 标签；选 zstd 但未安装 zstandard 时直接报错，不等到写点云时才失败。"""
+	if codec not in _POINT_CODECS:
+		raise ValueError(f"unknown point cloud codec: {codec}")
+	if codec == "zstd" and zstd is None:
+		raise RuntimeError("zstd 编码的点云需要安装 zstandard（pip install zstandard）")
+	return f"{codec}-base64-int16" + ("-delta" if delta else "")
+
+
+def _parse_point_encoding(encoding: str) -> tuple[str, bool]:
+	codec, _, rest = encoding.partition("-")
+	if codec not in _POINT_CODECS or rest not in ("base64-int16", "base64-int16-delta"):
+		raise ValueError(f"unknown point cloud encoding: {encoding}")
+	if codec == "zstd" and zstd is None:
+		raise RuntimeError("zstd 编码的点云需要安装 zstandard")
+	return codec, rest.endswith("-delta")
+
+
+def encode_point_cloud_bytes(
+	points: "Any", *, scale: int = 32767, encoding: str = DEFAULT_POINT_ENCODING
+) -> tuple[int, bytes]:
+	"""
+	点云量化为 int16 后按 encoding 压缩（zlib level 9 / zstd level 3，可选先差分），返回 (点数, 压缩字节)。
+	字节即 SQLite point_cloud_blob 的内容，也是 data_b64 解码后的内容。
 	"""
-将归一化点云编码为 JSON 友好的形式：
-- float32/float64 -> int16 量化
-- zlib 压缩
-- base64 编码
-"""
 	import numpy as np
 
+	codec, delta = _parse_point_encoding(encoding)
 	p = np.asarray(points, dtype=float)
 	if p.size == 0:
-		return {"encoding": "zlib-base64-int16", "n": 0, "scale": int(scale), "data_b64": ""}
+		return 0, b""
 	p = np.clip(p, -1.0, 1.0)
-	q = np.rint(p * float(scale)).astype(np.int16)
+	q = np.rint(p * float(scale)).astype("<i2")
+	if delta:
+		# 相邻采样点相关性强，差分后数值小、更好压；int16 溢出按模回绕，解码时 cumsum 再回绕即可还原
+		q = np.diff(q, axis=0, prepend=np.zeros((1, 2), dtype="<i2")).astype("<i2")
 	raw = q.tobytes()
-	comp = zlib.compress(raw, level=9)
+	if codec == "zstd":
+		return int(q.shape[0]), zstd.ZstdCompressor(level=3).compress(raw)
+	return int(q.shape[0]), zlib.compress(raw, level=9)
+
+
+def point_cloud_json(n: int, blob: bytes, *, scale: int = 32767, encoding: str = DEFAULT_POINT_ENCODING) -> dict[str, Any]:
+	"""把 encode_point_cloud_bytes 的结果包装为 index.json 中的 point_cloud 字段。"""
+	if n <= 0:
+		return {"encoding": encoding, "n": 0, "scale": int(scale), "data_b64": ""}
 	return {
-		"encoding": "zlib-base64-int16",
-		"n": int(q.shape[0]),
+		"encoding": encoding,
+		"n": int(n),
 		"scale": int(scale),
-		"data_b64": base64.b64encode(comp).decode("ascii"),
+		"data_b64": base64.b64encode(blob).decode("ascii"),
 	}
 
 
+def encode_point_cloud(points: "Any", *, scale: int = 32767, encoding: str = DEFAULT_POINT_ENCODING) -> dict[str, Any]:
+	"""
+将归一化点云编码为 JSON 友好的形式：
+- float32/float64 -> int16 量化
+- zlib（或 zstd）压缩
+- base64 编码
+"""
+	n, blob = encode_point_cloud_bytes(points, scale=scale, encoding=encoding)
+	return point_cloud_json(n, blob, scale=scale, encoding=encoding)
+
+
+def decode_point_cloud_bytes(blob: bytes, n: int, *, encoding: str = DEFAULT_POINT_ENCODING) -> "Any":
+	"""encode_point_cloud_bytes 的逆操作：压缩字节 -> int16 点云 (n,2)。"""
+	import numpy as np
+
+	codec, delta = _parse_point_encoding(encoding)
+	raw = zstd.ZstdDecompressor().decompress(blob) if codec == "zstd" else zlib.decompress(blob)
+	q = np.frombuffer(raw, dtype=np.int16)
+	try:
+		q = q.reshape((n, 2))
+	except Exception:
+		# 兼容：当 n 不可信时，按长度推断
+		q = q.reshape((-1, 2))
+	if delta:
+		q = np.cumsum(q, axis=0).astype(np.int16)
+	return q
+
+
 def decode_point_cloud(data: dict[str, Any]) -> "Any":
+	"""index.json 中 point_cloud 字段 -> 归一化 float 点云；缺少 encoding 字段的旧索引按 zlib-base64-int16 处理。"""
 	import numpy as np
 
 	if not data:
@@ -604,11 +1628,5 @@ def decode_point_cloud(data: dict[str, Any]) -> "Any":
 	if n <= 0 or not b64:
 		return np.zeros((0, 2), dtype=float)
 	comp = base64.b64decode(b64.encode("ascii"))
-	raw = zlib.decompress(comp)
-	q = np.frombuffer(raw, dtype=np.int16)
-	try:
-		q = q.reshape((n, 2))
-	except Exception:
-		# 兼容：当 n 不可信时，按长度推断
-		q = q.reshape((-1, 2))
+	q = decode_point_cloud_bytes(comp, n, encoding=str(data.get("encoding") or DEFAULT_POINT_ENCODING))
 	return q.astype(float) / float(scale)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# tools 下的脚本以顶层模块互相导入（from symbol_lib import ...）
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
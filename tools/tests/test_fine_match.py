@@ -0,0 +1,114 @@
+import math
+import random
+
+import ezdxf
+import pytest
+
+import symbol_lib
+from recognize_replace_symbols import best_fine_match, coarse_candidates, match_cluster, match_clusters_by_template
+from symbol_lib import (
+	bbox_of_geometry,
+	chamfer_best_rotation_many,
+	descriptor_from_geometry,
+	flatten_geometry,
+	point_cloud_from_geometry,
+	point_tree,
+	radial_profile,
+	stack_descriptors,
+)
+
+
+def _shape(msp, kind: int, cx: float, cy: float, size: float, angle: float, rng: random.Random) -> list:
+	"""在 msp 中画一个简单符号（kind 选形状），返回其实体列表。"""
+	def pt(x: float, y: float) -> tuple[float, float]:
+		c, s = math.cos(angle), math.sin(angle)
+		jx, jy = rng.uniform(-0.01, 0.01) * size, rng.uniform(-0.01, 0.01) * size
+		return cx + size * (c * x - s * y) + jx, cy + size * (s * x + c * y) + jy
+
+	ents = []
+	if kind == 0:
+		ents.append(msp.add_lwpolyline([pt(-0.5, -0.5), pt(0.5, -0.5), pt(0.5, 0.5), pt(-0.5, 0.5)], close=True))
+	elif kind == 1:
+		ents.append(msp.add_lwpolyline([pt(-0.5, -0.4), pt(0.5, -0.4), pt(0.0, 0.5)], close=True))
+	elif kind == 2:
+		ents.append(msp.add_circle(pt(0, 0), radius=0.5 * size))
+		ents.append(msp.add_line(pt(-0.5, 0), pt(0.5, 0)))
+		ents.append(msp.add_line(pt(0, -0.5), pt(0, 0.5)))
+	else:
+		ents.append(msp.add_lwpolyline([pt(-0.5, -0.25), pt(0.5, -0.25), pt(0.5, 0.25), pt(-0.5, 0.25)], close=True))
+		ents.append(msp.add_line(pt(-0.5, -0.25), pt(0.5, 0.25)))
+	return ents
+
+
+def _make_case(seed: int) -> tuple[dict, list[list]]:
+	rng = random.Random(seed)
+	doc = ezdxf.new()
+	msp = doc.modelspace()
+	sample_div, max_points = 30.0, 200
+
+	library = []
+	template_points = {}
+	for kind in range(4):
+		for variant in range(2):
+			name = f"S{kind}_{variant}"
+			geoms = flatten_geometry(_shape(msp, kind, 0.0, 0.0, 10.0, 0.1 * variant, rng), doc)
+			bb = bbox_of_geometry(geoms)
+			pts = point_cloud_from_geometry(geoms, bb, sample_div=sample_div, max_points=max_points)
+			library.append((name, descriptor_from_geometry(geoms, bb)))
+			template_points[name] = {"points": pts, "radii": radial_profile(pts), "tree": point_tree(pts)}
+
+	clusters = []
+	for i in range(12):
+		ents = _shape(msp, rng.randrange(4), 100.0 * i, 0.0, rng.uniform(5.0, 20.0), rng.choice([0.0, math.pi / 2, math.pi]), rng)
+		clusters.append(flatten_geometry(ents, doc))
+
+	ctx = {
+		"library_names": [name for name, _ in library],
+		"library_stack": stack_descriptors([d for _, d in library]),
+		"template_points": template_points,
+		"max_size": 1e9,
+		"score_threshold": 1e9,
+		"coarse_metric": "list",
+		"coarse_topk": 5,
+		"sample_div": sample_div,
+		"max_points": max_points,
+		"chamfer_threshold": 0.2,
+		"use_canonical": False,
+	}
+	return ctx, clusters
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("n_jobs", [1, 3])
+def test_match_clusters_by_template_matches_serial(seed: int, n_jobs: int) -> None:
+	ctx, clusters = _make_case(seed)
+	serial = [match_cluster(g, ctx) for g in clusters]
+	assert any(r is not None for r in serial)
+	assert match_clusters_by_template(clusters, ctx, n_jobs=n_jobs) == serial
+
+
+def _exhaustive_fine_match(probes: list, template_points: dict, cand_pts) -> tuple:
+	"""不剪枝：逐个模板算 Chamfer，取最小者，并列取 coarse 顺序靠前者。"""
+	best = (None, float("inf"), float("inf"), 0.0)
+	for coarse, name in probes:
+		ch_score, angle = chamfer_best_rotation_many([template_points[name]["points"]], cand_pts)[0]
+		if ch_score < best[2]:
+			best = (name, coarse, ch_score, angle)
+	return best
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2, 3])
+@pytest.mark.parametrize("with_scipy", [True, False])
+def test_best_fine_match_pruning_matches_exhaustive(seed: int, with_scipy: bool, monkeypatch) -> None:
+	if with_scipy and symbol_lib._ckdtree() is None:
+		pytest.skip("需要 scipy")
+	if not with_scipy:
+		# 无 scipy 时走 int16 量化的暴力最近邻
+		monkeypatch.setattr(symbol_lib, "_ckdtree", lambda: None)
+	ctx, clusters = _make_case(seed)
+	template_points = ctx["template_points"]
+	if not with_scipy:
+		template_points = {name: {**t, "tree": None} for name, t in template_points.items()}
+	for geoms in clusters:
+		_, probes, cand_pts = coarse_candidates(geoms, ctx)
+		assert best_fine_match(probes, template_points, cand_pts) == _exhaustive_fine_match(probes, template_points, cand_pts)
@@ -0,0 +1,41 @@
+import random
+
+from legend_to_blocks import overlap, overlap_candidate_pairs
+
+
+def _brute_pairs(boxes: list, tol: float) -> set:
+	return {(i, j) for i in range(len(boxes)) for j in range(i + 1, len(boxes)) if overlap(boxes[i], boxes[j], tol)}
+
+
+def _grid_pairs(boxes: list, tol: float) -> set:
+	pairs = list(overlap_candidate_pairs(boxes, tol))
+	# 每对只产出一次
+	assert len(pairs) == len(set(pairs))
+	assert all(i < j for i, j in pairs)
+	return {(i, j) for i, j in pairs if overlap(boxes[i], boxes[j], tol)}
+
+
+def _small_boxes(rng: random.Random, n: int) -> list:
+	out = []
+	for _ in range(n):
+		x, y = rng.uniform(0.0, 200.0), rng.uniform(0.0, 150.0)
+		out.append((x, y, x + 1.0, y + 1.0))
+	return out
+
+
+def test_overlap_candidate_pairs_matches_brute_force() -> None:
+	rng = random.Random(0)
+	boxes = _small_boxes(rng, 300)
+	for _ in range(20):
+		x, y = rng.uniform(0.0, 200.0), rng.uniform(0.0, 150.0)
+		boxes.append((x, y, x + rng.uniform(0.0, 30.0), y + rng.uniform(0.0, 30.0)))
+	assert _grid_pairs(boxes, 0.5) == _brute_pairs(boxes, 0.5)
+
+
+def test_overlap_candidate_pairs_oversized_box() -> None:
+	# 一个远大于中位尺寸的框（如图例外框）：不能按面积登记网格，否则耗时/内存随面积暴涨
+	rng = random.Random(1)
+	boxes = _small_boxes(rng, 200)
+	boxes.insert(57, (-10.0, -10.0, 20000.0, 15000.0))
+	boxes.append((-5000.0, 100.0, 5000.0, 101.0))
+	assert _grid_pairs(boxes, 0.5) == _brute_pairs(boxes, 0.5)